@@ -0,0 +1,88 @@
+import math
+import re
+from passgen import CLASSES
+
+
+WEAK_BITS = 60 # passwords with lower estimated strength are reported as weak
+ISSUES = ['reused password', 'duplicate entry', 'weak password']
+
+_class_sets = [frozenset(chars) for chars in CLASSES.values()]
+_known_chars = frozenset(''.join(CLASSES.values()))
+# optional scheme, optional user@, optional www., then host (or [IPv6]) up to port, path, query or fragment
+_site = re.compile(r'(?:[a-z][a-z0-9+.-]*://)?(?:[^@/?#]*@)?(?:www\.)?(\[[^\]]*\]|[^:/?#]*)')
+
+
+def entropy(password: str) -> float:
+    """Estimated strength of password in bits: length * log2(alphabet size).
+    Alphabet is every character class of passgen the password uses, characters outside them are counted one by one."""
+    chars = set(password)
+    pool = sum(len(s) for s in _class_sets if not chars.isdisjoint(s))
+    pool += len(chars - _known_chars)
+    return len(password) * math.log2(pool) if pool > 1 else 0.0
+
+
+def site_key(link: str) -> str:
+    """Link reduced to the site it points to: no scheme, www., port, path or case. Text that is not a URL is only stripped and lowercased."""
+    link = link.strip().lower()
+    if ' ' in link: # not a URL
+        return link
+    return _site.match(link).group(1) or link
+
+
+def account_key(cell) -> tuple:
+    """(site, login) of cell, email is used if there is no login. Empty tuple if cell has no site or no login."""
+    site = site_key(cell.link) or cell.name.strip().lower()
+    login = (cell.login or cell.email).strip().lower()
+    return (site, login) if site and login else ()
+
+
+def _groups(cells, key) -> list:
+    """Groups of cells with same non-empty key, one pass with a hash map. Largest groups first."""
+    buckets = {}
+    for cell in cells:
+        k = key(cell)
+        if k:
+            buckets.setdefault(k, []).append(cell)
+    return sorted((i for i in buckets.values() if len(i) > 1), key=len, reverse=True)
+
+
+def audit(cells, weak_bits: float=WEAK_BITS) -> dict:
+    """Find reused passwords, duplicate entries (same site and login) and weak passwords. Linear in number of cells.
+    Returns {'reused': [[cell, ...], ...], 'duplicates': [[cell, ...], ...], 'weak': [cell, ...], 'bits': {id: bits}}, weakest cells first."""
+    cells = list(cells)
+    bits = {}
+    scores = {} # password -> bits, reused passwords are scored once
+    for cell in cells:
+        if cell.password:
+            if cell.password not in scores:
+                scores[cell.password] = entropy(cell.password)
+            bits[cell.id] = scores[cell.password]
+    weak = sorted((i for i in cells if i.password and bits[i.id] < weak_bits), key=lambda i: bits[i.id])
+    return {
+        'reused': _groups(cells, lambda i: i.password),
+        'duplicates': _groups(cells, account_key),
+        'weak': weak,
+        'bits': bits
+    }
+
+
+def report(result: dict) -> tuple:
+    """Rows of audit result for Database.export_db: (cells, columns). A cell is listed once per issue it has."""
+    cells = []
+    columns = {'issue': [], 'group': [], 'bits': []}
+    def add(cell, issue: str, group) -> None:
+        cells.append(cell)
+        columns['issue'].append(issue)
+        columns['group'].append(group)
+        columns['bits'].append(round(result['bits'].get(cell.id, 0.0), 1))
+    for issue, groups in zip(ISSUES, [result['reused'], result['duplicates']]):
+        for n, group in enumerate(groups, 1):
+            for cell in group:
+                add(cell, issue, n)
+    for cell in result['weak']:
+        add(cell, ISSUES[2], '')
+    return cells, columns
+
+
+if __name__ == '__main__':
+    print("The audit library file cannot be started.")
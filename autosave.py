@@ -0,0 +1,56 @@
+import threading
+from database import Database
+
+
+class AutoSaver:
+    """Saves database in a background thread when it was not changed for delay seconds."""
+    def __init__(self, database: Database, delay: float=1.0):
+        self.database = database
+        self.delay = delay
+        self.error = None # last exception of background save, to be shown by app
+        self._dirty = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        database.on_change = self._dirty.set
+
+    def start(self) -> None:
+        """Start background thread."""
+        self._thread.start()
+
+    def _run(self) -> None:
+        """Wait for changes, then save once changes stop coming."""
+        while not self._stopped.is_set():
+            self._dirty.wait()
+            while self._dirty.is_set() and not self._stopped.is_set(): # coalesce changes
+                self._dirty.clear()
+                self._stopped.wait(self.delay)
+            if self._stopped.is_set():
+                return # stop() saves the rest
+            self._save()
+
+    def _save(self) -> None:
+        """Save database, keep error for app instead of printing it over user input."""
+        try:
+            self.database.save()
+        except Exception as e:
+            self.error = e
+            self._dirty.set() # try again later
+
+    def flush(self) -> None:
+        """Save now, in calling thread."""
+        self._dirty.clear()
+        self.database.save()
+
+    def stop(self, save: bool=True) -> None:
+        """Stop background thread and save everything that is left (unless save=False)."""
+        self._stopped.set()
+        self._dirty.set() # wake thread up
+        if self._thread.is_alive():
+            self._thread.join()
+        self.database.on_change = None
+        if save:
+            self.flush()
+
+
+if __name__ == '__main__':
+    print("The autosave library file cannot be started.")
@@ -0,0 +1,179 @@
+"""Measure how Database operations scale with vault size.
+
+Usage: python benchmarks/operations.py [--sizes 1000 10000 ...] [--memory] [--in-memory] [--output results.json]
+Generates synthetic vaults in a temporary directory (or in memory, with --in-memory: disk speed is
+left out) and times load, save (also their async versions), search_db, gen_id, update, audit and export_db on each. Nothing interactive is started. Results are printed as JSON lines
+(one per operation) and, with --output, also written as one JSON document to compare runs.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+from os import path
+import platform
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = path.dirname(path.dirname(path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database import Database, DataCell
+from storage import MemoryBackend
+import audit
+
+DOMAINS = ['gmail.com', 'yandex.ru', 'outlook.com', 'proton.me', 'mail.ru']
+QUERIES = ['goo', 'github', 'user123', 'site', 'qwerty']
+OPERATIONS = 1000 # gen_id/update calls per measurement
+
+
+def random_word(rnd: random.Random, low: int, high: int) -> str:
+    """Lowercase word of random length."""
+    return ''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(low, high)))
+
+
+def make_cells(n: int, seed: int=0) -> list:
+    """Generate n cell dictionaries with field lengths close to real vaults."""
+    rnd = random.Random(seed)
+    password_chars = string.ascii_letters + string.digits + string.punctuation
+    cells = []
+    for i in range(n):
+        name = random_word(rnd, 3, 12)
+        login = random_word(rnd, 4, 10) + str(rnd.randint(0, 999))
+        cells.append({
+            'name': name.capitalize(),
+            'link': f'https://{name}.com' + ('/' + random_word(rnd, 3, 10) if rnd.random() < 0.3 else ''),
+            'login': login,
+            'email': f'{login}@{rnd.choice(DOMAINS)}' if rnd.random() < 0.7 else '',
+            'password': ''.join(rnd.choices(password_chars, k=rnd.randint(8, 20))),
+            'other_data': ' '.join(random_word(rnd, 2, 9) for _ in range(rnd.randint(1, 8))) if rnd.random() < 0.2 else '',
+            'codes': ' '.join(str(rnd.randint(10000, 99999)) for _ in range(rnd.randint(4, 10))) if rnd.random() < 0.05 else '',
+            'id': i
+        })
+    return cells
+
+
+def measure(fn, memory: bool, reset=None) -> dict:
+    """Run fn, return its time. With memory=True run it again under tracemalloc to get peak memory,
+    reset() is called before that so the second run does the same work (no cache hits, no grown database)."""
+    start = time.perf_counter()
+    fn()
+    result = {'seconds': time.perf_counter() - start}
+    if memory:
+        if reset is not None:
+            reset()
+        tracemalloc.start()
+        fn()
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def bench_size(n: int, directory: str, memory: bool, in_memory: bool=False) -> list:
+    """Run all measurements on a vault of n cells. With in_memory=True database files are kept in a MemoryBackend (exports still go to directory)."""
+    db_path = path.join(directory, 'database.dat')
+    key_path = path.join(directory, 'key.dat')
+    database = Database(db_path=db_path, key_path=key_path, backend=MemoryBackend() if in_memory else None)
+    database.initialize()
+    cells = make_cells(n)
+    results = []
+
+    def record(op: str, fn, reset=None) -> None:
+        result = {'cells': n, 'op': op}
+        result.update(measure(fn, memory, reset))
+        results.append(result)
+        print(json.dumps(result))
+
+    record('load_json', lambda: database.load(cells))
+    record('save', database.save)
+    record('load', lambda: database.load(None))
+    record('save_async', lambda: asyncio.run(database.save_async()))
+    record('load_async', lambda: asyncio.run(database.load_async()))
+    for q in QUERIES:
+        record(f'search_db:{q}', lambda: database.search_db(q), database._search_cache.clear)
+
+    def gen_ids() -> None:
+        for _ in range(OPERATIONS):
+            database.gen_id()
+    record(f'gen_id x{OPERATIONS}', gen_ids)
+
+    new_cells = make_cells(OPERATIONS, seed=1)
+    inserted = []
+    def insert() -> None:
+        for i in new_cells:
+            cell = DataCell(i)
+            cell.id = database.gen_id()
+            database.update(cell)
+            inserted.append(cell.id)
+    def remove_inserted() -> None:
+        for i in inserted:
+            database.rm(i)
+        inserted.clear()
+    record(f'update(new) x{OPERATIONS}', insert, remove_inserted)
+
+    rnd = random.Random(2)
+    ids = rnd.sample(database.ids(), min(OPERATIONS, len(database.ids())))
+    names = {i: database.find_cell(i).name for i in ids}
+    def edit() -> None:
+        for i in ids:
+            cell = database.find_cell(i)
+            cell.update('name', random_word(rnd, 3, 12))
+            database.update(cell)
+    def restore_names() -> None:
+        for i in ids:
+            cell = database.find_cell(i)
+            cell.update('name', names[i])
+            database.update(cell)
+    record(f'update(edit) x{len(ids)}', edit, restore_names)
+    record('audit', lambda: audit.audit(database.data_cells))
+
+    for export_format in database.export_formats:
+        export_dir = path.join(directory, 'export_' + export_format)
+        def export() -> None:
+            shutil.rmtree(export_dir, ignore_errors=True)
+            os.mkdir(export_dir)
+            with contextlib.redirect_stdout(io.StringIO()):
+                database.export_db(export_dir, export_format)
+        record(f'export_db:{export_format}', export)
+    return results
+
+
+def git_commit() -> str:
+    """Current commit of repository, if it can be found."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='psm database benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='vault sizes (cells)')
+    parser.add_argument('--memory', action='store_true', help='also record peak memory (runs each operation twice)')
+    parser.add_argument('--in-memory', action='store_true', help='keep database files in memory, not on disk')
+    parser.add_argument('--output', default=None, help='write all results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    for n in args.sizes:
+        directory = tempfile.mkdtemp(prefix='psm-bench-')
+        try:
+            results.extend(bench_size(n, directory, args.memory, args.in_memory))
+        finally:
+            shutil.rmtree(directory)
+
+    if args.output:
+        report = {'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(), 'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Measure password generation throughput and check character distribution.
+
+Usage: python benchmarks/passwords.py [--count N] [--lengths 10 16 32] [--check]
+Prints one JSON line per measurement. With --check also runs chi-squared tests on a large batch:
+characters of each class must be uniform and each class must be equally likely at every position
+(this is what the shuffle guarantees). Exits with code 1 if a test fails at p < 0.001.
+"""
+import argparse
+import json
+from os import path
+import sys
+import time
+
+ROOT = path.dirname(path.dirname(path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import passgen
+
+Z = 3.09 # one-sided normal quantile for p = 0.001
+
+
+def chi2_limit(df: int) -> float:
+    """Critical chi-squared value for p = 0.001 (Wilson-Hilferty approximation)."""
+    return df * (1 - 2 / (9 * df) + Z * (2 / (9 * df)) ** 0.5) ** 3
+
+
+def chi2(observed: list, expected: float) -> float:
+    """Chi-squared statistic of counts against equal expected count."""
+    return sum((i - expected) ** 2 / expected for i in observed)
+
+
+def throughput(count: int, length: int) -> list:
+    """Passwords per second with single and batch API."""
+    results = []
+    start = time.perf_counter()
+    for _ in range(count):
+        passgen.generate(length)
+    results.append({'op': 'generate', 'length': length, 'count': count, 'per_second': count / (time.perf_counter() - start)})
+    start = time.perf_counter()
+    passgen.generate_batch(count, length)
+    results.append({'op': 'generate_batch', 'length': length, 'count': count, 'per_second': count / (time.perf_counter() - start)})
+    return results
+
+
+def check(count: int, length: int) -> list:
+    """Chi-squared tests of one batch. Returns failed test names."""
+    passwords = passgen.generate_batch(count, length)
+    counts = passgen.class_counts(length)
+    failed = []
+    for name, alphabet in passgen.CLASSES.items():
+        if name not in counts:
+            continue
+        # every character of class is equally likely
+        found = {c: 0 for c in alphabet}
+        positions = [0] * length
+        for p in passwords:
+            for n, c in enumerate(p):
+                if c in found:
+                    found[c] += 1
+                    positions[n] += 1
+        if sum(found.values()) != counts[name] * count:
+            failed.append(f'{name}: count')
+        stat = chi2(list(found.values()), counts[name] * count / len(alphabet))
+        print(json.dumps({'test': f'{name}: characters', 'chi2': stat, 'limit': chi2_limit(len(alphabet) - 1)}))
+        if stat > chi2_limit(len(alphabet) - 1):
+            failed.append(f'{name}: characters')
+        # class is spread over all positions
+        stat = chi2(positions, counts[name] * count / length)
+        print(json.dumps({'test': f'{name}: positions', 'chi2': stat, 'limit': chi2_limit(length - 1)}))
+        if stat > chi2_limit(length - 1):
+            failed.append(f'{name}: positions')
+    return failed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='psm password generation benchmark')
+    parser.add_argument('--count', type=int, default=10000, help='passwords per measurement')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[10, 16, 32])
+    parser.add_argument('--check', action='store_true', help='run distribution tests, fail if they do not pass')
+    args = parser.parse_args()
+
+    for length in args.lengths:
+        for result in throughput(args.count, length):
+            print(json.dumps(result))
+    if args.check:
+        failed = check(max(args.count, 100000), 16)
+        if failed:
+            print(f'Failed: {", ".join(failed)}.')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Measure psm startup: time to password prompt and time to first command.
+
+Usage: python benchmarks/startup.py [--cells N] [--runs N] [--max-prompt SECONDS]
+Runs psm.py in a fresh process against a temporary vault and prints one JSON line per run
+and a summary line. Exits with code 1 if median time to password prompt is above --max-prompt.
+"""
+import argparse
+import json
+import os
+from os import path
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = path.dirname(path.dirname(path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'benchmark'
+
+# runs inside psm's directory, answers prompts and records when they appear
+DRIVER = '''
+import time
+t0 = time.perf_counter()
+import builtins, json, os
+import psm
+times = {'import': time.perf_counter() - t0}
+def getpass(prompt=''):
+    times.setdefault('password_prompt', time.perf_counter() - t0)
+    return %r
+def input(prompt=''):
+    if prompt == '> ':
+        times['first_command'] = time.perf_counter() - t0
+        return 'exit'
+    return ''
+psm.getpass = getpass
+builtins.input = input
+psm.main()
+print(json.dumps(times))
+''' % PASSWORD
+
+
+def make_vault(directory: str, cells: int) -> None:
+    """Copy psm to directory and create a vault with given number of cells there."""
+    import kdf
+    from database import Database
+    for i in os.listdir(ROOT): # psm and modules it imports
+        if i.endswith('.py'):
+            shutil.copy(path.join(ROOT, i), directory)
+    os.mkdir(path.join(directory, 'data'))
+    params, key = kdf.create(PASSWORD)
+    kdf.save_params(path.join(directory, 'data', 'vault.json'), [params])
+    database = Database(db_path=path.join(directory, 'data', 'database.dat'), key_path=path.join(directory, 'data', 'key.dat'), keys=[key])
+    database.initialize()
+    database.load([{'name': f'site {i}', 'link': f'https://site{i}.com', 'login': f'user{i}', 'password': 'p' * 12, 'id': i} for i in range(cells)])
+    database.save()
+
+
+def run_once(directory: str) -> dict:
+    """Start psm once, return measured times in seconds."""
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', DRIVER], cwd=directory, capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process'] = time.perf_counter() - start
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='psm startup benchmark')
+    parser.add_argument('--cells', type=int, default=1000, help='cells in test vault')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-prompt', type=float, default=None, help='fail if median time to password prompt is above this (seconds)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='psm-bench-')
+    try:
+        make_vault(directory, args.cells)
+        runs = []
+        for _ in range(args.runs):
+            runs.append(run_once(directory))
+            print(json.dumps(runs[-1]))
+    finally:
+        shutil.rmtree(directory)
+
+    summary = {'benchmark': 'startup', 'cells': args.cells, 'runs': args.runs}
+    for i in runs[0]:
+        summary[i] = statistics.median(run[i] for run in runs)
+    print(json.dumps(summary))
+    if args.max_prompt is not None and summary['password_prompt'] > args.max_prompt:
+        print(f'Password prompt took {summary["password_prompt"]:.3f} s, limit is {args.max_prompt} s.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
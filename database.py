@@ -1,14 +1,88 @@
 import json
-from cryptography.fernet import Fernet
-from os import path, mkdir
-import difflib
-from copy import deepcopy
-import pandas as pd
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+import os
+from os import path
+import heapq
+from collections import OrderedDict
+from functools import partial
+from bisect import bisect_left
+import threading
+import time
+from ranking import rank, EPSILON
+import metrics
+from storage import Backend, FileBackend
+# heavy or rarely needed modules (csv, openpyxl, concurrent.futures) are imported where used, to keep startup fast
+
+
+FIELDS = ['name', 'link', 'login', 'email', 'password', 'other_data', 'codes'] # searchable items
+JOURNAL_MIN_RECORDS = 100 # journal is never compacted while it is smaller than this
+JOURNAL_RATIO = 0.5 # ... or smaller than this part of database size
+MERGE_INSERT_RATIO = 16 # imports smaller than 1/16 of database are inserted one by one, bigger ones are sorted in
+CHUNKED_HEADER = b'PSM-CHUNKED-1' # first line of database file (followed by generation), then one encrypted chunk of cells per line
+CHUNK_SIZE = 1000 # cells per chunk
+HISTORY_SIZE = 5 # previous passwords kept in each cell
+EXPORT_HEADER = ['Resource', 'Link', 'Login', 'Email', 'Password', 'Other data', 'Codes', 'ID in database'] # xlsx & csv
+
+
+def ngrams(s: str, n: int=3) -> set:
+    """Get set of n-grams of lowercased string. Padded, so short strings have n-grams too."""
+    s = '  ' + s.lower() + ' '
+    return {s[i:i+n] for i in range(len(s)-n+1)}
+
+
+def encrypt_chunk(cipher: MultiFernet, chunk: list) -> bytes:
+    """Serialize and encrypt list of cell dictionaries into one line of database file."""
+    with metrics.timer('save.json_dump'):
+        data = json.dumps(chunk).encode()
+    metrics.count('bytes_encrypted', len(data))
+    with metrics.timer('save.encrypt'):
+        return cipher.encrypt(data) + b'\n'
+
+
+def decrypt_chunk(cipher: MultiFernet, line: bytes) -> list:
+    """Decrypt one line of database file into list of cell dictionaries."""
+    with metrics.timer('load.decrypt'):
+        data = cipher.decrypt(line.strip())
+    metrics.count('bytes_decrypted', len(data))
+    with metrics.timer('load.json_parse'):
+        return json.loads(data.decode())
+
+
+def dedup_key(cell) -> tuple:
+    """Cells with same key are treated as duplicates on import."""
+    return cell.name.strip().lower(), cell.login.strip().lower(), cell.link.strip().lower()
+
+
+def read_table(file_path: str):
+    """Iterate over cell dictionaries in .csv or .xlsx file written by export_db."""
+    columns = FIELDS + ['id']
+    if file_path.lower().endswith('.xlsx'):
+        from openpyxl import load_workbook
+        wb = load_workbook(file_path, read_only=True) # rows are read one at a time
+        try:
+            for row in wb.active.iter_rows(min_row=2, values_only=True):
+                yield {k: '' if v is None else str(v) for k, v in zip(columns, row)}
+        finally:
+            wb.close()
+    else:
+        import csv
+        with open(file_path, newline='', encoding='utf-8') as f:
+            rows = csv.reader(f)
+            next(rows, None) # header
+            for row in rows:
+                yield dict(zip(columns, row))
+
+
+def sort_key(cell) -> tuple:
+    """Key cells are ordered by in Database. Id makes it unique."""
+    return cell.name.lower(), cell.id
 
 
 class DataCell:
     """Class to interact with data."""
-    # items: name link login email password other_data codes id
+    # items: name link login email password other_data codes id changed history
+    __slots__ = FIELDS + ['id', 'changed', 'history'] # no per-instance __dict__, matters for big databases
+
     def __init__(self, x: dict):
         self.name = x.get('name', '')
         self.link = x.get('link', '')
@@ -18,171 +92,820 @@ class DataCell:
         self.other_data = x.get('other_data', '')
         self.codes = x.get('codes', '')
         self.id = x.get('id', None)
+        self.changed = x.get('changed', None) # time of last password change, None if unknown
+        self.history = tuple(x.get('history', ())) # previous passwords as {'password', 'changed'}, newest first
+
+    def to_dict(self) -> dict:
+        """Convert to dictionary, as stored in database file."""
+        x = {
+            "name": self.name,
+            "link": self.link,
+            "login": self.login,
+            "email": self.email,
+            "password": self.password,
+            "other_data": self.other_data,
+            "codes": self.codes,
+            "id": self.id
+        }
+        if self.changed is not None: # cells of older versions are stored as they were
+            x["changed"] = self.changed
+        if self.history:
+            x["history"] = list(self.history)
+        return x
     
     def update(self, elem: str, value: str) -> None:
         """Update any value (except id)"""
-        if elem == 'name':
-            self.name = value
-        elif elem == 'link':
-            self.link = value
-        elif elem == 'login':
-            self.login = value
-        elif elem == 'email':
-            self.email = value
-        elif elem == 'password':
-            self.password = value
-        elif elem == 'other_data':
-            self.other_data = value
-        elif elem == 'codes':
-            self.other_data = value
+        if elem == 'password':
+            self.set_password(value)
+        elif elem in FIELDS:
+            setattr(self, elem, value)
         else:
             print('Incorrect element: ', elem)
 
+    def set_password(self, value: str, when: float=None) -> None:
+        """Change password, previous one goes to history."""
+        if value == self.password:
+            return
+        if self.password:
+            self.history = ({'password': self.password, 'changed': self.changed},) + self.history[:HISTORY_SIZE - 1]
+        self.password = value
+        self.changed = time.time() if when is None else when
+
+
+class LazyCells:
+    """Read-only sequence of cells in name order, decrypted from store (or snapshot) records when accessed."""
+    def __init__(self, store):
+        self.store = store
+        self._len = store.count() # store is not changed while view is used
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self._len)
+            return [DataCell(x) for x in self.store.cells(start, stop)][::step]
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError('cell index out of range')
+        return DataCell(self.store.cells(i, i + 1)[0])
+
+    def __iter__(self):
+        for _, cell in self.store.iter_rows():
+            yield DataCell(cell)
+
+
+class _StoreKeys:
+    """Sort keys of store (or snapshot) records by position, for bisect. Only names are decrypted."""
+    def __init__(self, store):
+        self.store = store
+        self._len = store.count()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i: int) -> tuple:
+        return self.store.sort_key_at(i)
+
 
 class Database:
     """Class that holds all DataCells."""
-    def __init__(self, db_path: str=path.join('data', 'database.dat'), key_path: str=path.join('data', 'key.dat')):
-        self.data_cells = []
-        global DB_PATH
-        DB_PATH = db_path
-        global DB_KEY_PATH
-        DB_KEY_PATH = key_path
-        self.export_formats = ['xlsx', 'json']
+    def __init__(self, db_path: str=path.join('data', 'database.dat'), key_path: str=path.join('data', 'key.dat'), journal: bool=False, workers: int=1, use_processes: bool=False, search_cache_size: int=128, keys: list=None, backend: Backend=None, store=None, snapshot_path: str=None):
+        self.data_cells = [] # always sorted by name
+        self._sort_keys = [] # sort key of each cell in data_cells, same order
+        self._cell_keys = {} # DataCell -> sort key it was inserted with
+        self._index = {} # n-gram -> set of DataCells containing it
+        self._cell_grams = {} # DataCell -> n-grams it was indexed by (cells are edited in place)
+        self._cell_dedup = {} # DataCell -> dedup key it was indexed by
+        self._dedup_counts = {} # dedup key -> number of cells with it, for imports
+        self._cells_by_id = {}
+        self._free_ids = [] # heap of (first, stop) ranges of unused ids below self._next_id, ids in them may be taken since
+        self._next_id = 0
+        self._sorted_ids = None # cache for ids()
+        self.journal = journal # save only changes to journal file, compact it into database file from time to time
+        self._changes = {} # id -> True if cell was put, False if removed; since last save
+        self._journal_records = 0
+        self._generation = 0 # number of database file rewrites, journal records of older files are not replayed
+        self._needs_snapshot = True # whole database has to be rewritten on next save
+        self._keys = keys # Fernet keys, newest first; read from key file once per session if not given
+        self.uses_key_file = keys is None
+        self._cipher = None
+        self.workers = workers # chunks are encrypted/decrypted in parallel if > 1
+        self.use_processes = use_processes # processes also parallelize JSON work, but cost more to start
+        self.db_path = db_path # paths are per instance, so other databases can be opened (imports)
+        self.key_path = key_path
+        self.backend = backend if backend is not None else FileBackend(db_path) # where snapshot and journal are stored
+        self.store = store # if given, cells are kept as separately encrypted records there (SqliteStore) instead of backend
+        self.snapshot_path = snapshot_path # read-only MmapSnapshot of backend files, opened instead of them while it is up to date
+        self._reader = None # store or snapshot records are read from while database is lazy
+        self._lazy = False # cells are not read yet, data_cells is a LazyCells view of self._reader
+        self._store_pos = {} # id -> position of cell's record in store
+        self.export_formats = ['xlsx', 'json', 'csv', 'ndjson']
+        self.lock = threading.RLock() # held while cells are changed or serialized, save() may run in another thread
+        self._save_lock = threading.Lock() # one write to files at a time
+        self.on_change = None # called after every change, e.g. to schedule autosave
+        self.version = 0 # grows on every change, search cache is valid for one version
+        self.search_cache_size = search_cache_size
+        self._search_cache = OrderedDict() # (query, x) -> all results, least recently used first
+        self._search_cache_version = 0
+        self.search_stats = {'hits': 0, 'refined': 0, 'misses': 0}
     
+    def _get_keys(self) -> list:
+        """Get database keys, newest first. Key file may hold several keys while key is being rotated."""
+        if self._keys is None:
+            with metrics.timer('load.key_read'), open(self.key_path, 'rb') as key_file:
+                self._keys = [i.strip() for i in key_file if i.strip()]
+        return self._keys
+
+    def _get_cipher(self) -> MultiFernet:
+        """Get cipher for database."""
+        if self._cipher is None:
+            self._cipher = MultiFernet([Fernet(i) for i in self._get_keys()])
+            if self.store is not None:
+                self.store.set_keys(self._get_keys())
+        return self._cipher
+
+    def _write_key_file(self, keys: list) -> None:
+        """Write keys (newest first) to key file."""
+        temp_path = self.key_path + '.tmp'
+        with open(temp_path, 'wb') as key_file:
+            key_file.write(b'\n'.join(keys))
+            key_file.flush()
+            os.fsync(key_file.fileno())
+        os.replace(temp_path, self.key_path)
+        self._keys = keys
+        self._cipher = None
+
+    def reencrypt(self, new_key: bytes) -> None:
+        """Rewrite database file with new key. Old keys are used for reading until it is done."""
+        self._keys = [new_key] + self._get_keys()
+        self._cipher = None
+        with self.lock:
+            self._needs_snapshot = True
+        self.save()
+        self._keys = [new_key]
+        self._cipher = None
+
+    def rotate_key(self) -> None:
+        """Re-encrypt database with a new key from key file."""
+        new_key = Fernet.generate_key()
+        # every step below leaves files that can be decrypted with key file contents
+        self._write_key_file([new_key] + self._get_keys())
+        self.reencrypt(new_key)
+        self._write_key_file([new_key])
+
+    def _map_chunks(self, fn, items):
+        """Map fn over items keeping order. Uses a pool if workers > 1 and there is enough work for it."""
+        items = iter(items)
+        batch_size = self.workers * 2 # only this many items are in memory at once
+        batch = [i for _, i in zip(range(batch_size), items)]
+        if self.workers <= 1 or len(batch) < batch_size: # sequential fallback, same output
+            yield from map(fn, batch)
+            yield from map(fn, items)
+            return
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        pool_type = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+        with pool_type(max_workers=self.workers) as pool:
+            while batch:
+                yield from pool.map(fn, batch)
+                batch = [i for _, i in zip(range(batch_size), items)]
+
+    def _iter_file(self):
+        """Iterate over cell dictionaries in database file (without journal), decrypting one chunk at a time."""
+        cipher = self._get_cipher()
+        lines = self.backend.lines('snapshot')
+        first_line = next(lines, b'').strip()
+        header = first_line.split(b' ')
+        if header[0] != CHUNKED_HEADER: # 1.0.2 and older: whole database is one token
+            self._needs_snapshot = True # converted on next save
+            yield from decrypt_chunk(cipher, first_line)
+            return
+        self._generation = int(header[1]) if len(header) > 1 else 0 # files before 1.2.0 have no generation
+        for chunk in self._map_chunks(partial(decrypt_chunk, cipher), lines):
+            yield from chunk
+
+    def iter_json(self):
+        """Iterate over cell dictionaries of database with journal applied."""
+        if self.store is not None:
+            self._get_cipher()
+            return (cell for _, cell in self.store.iter_rows())
+        if self.backend.exists('journal'):
+            return self._replay_journal(self._iter_file(), self._get_cipher())
+        return self._iter_file()
+
     def get_json(self) -> list:
         """Get JSON dictionary of database."""
-        with open(DB_KEY_PATH, 'r') as key_file:
-            key = key_file.readline()
-        cipher = Fernet(key)
-        with open(DB_PATH, 'rb') as data_file:
-            data_encoded =  data_file.readline()
-            data_s = cipher.decrypt(data_encoded).decode()
-        data_json = json.loads(data_s)
-        return data_json
+        return list(self.iter_json())
+
+    def _replay_journal(self, data_json, cipher: MultiFernet) -> list:
+        """Apply changes from journal file to JSON of database file."""
+        cells = {i.get('id'): i for i in data_json} # journal exists only next to files with unique ids
+        self._journal_records = 0
+        with metrics.timer('load.journal'):
+            for line in self.backend.lines('journal'):
+                try:
+                    record = json.loads(cipher.decrypt(line.strip()).decode())
+                except InvalidToken: # torn write at crash, everything after it is lost anyway
+                    self._needs_snapshot = True
+                    break
+                self._journal_records += 1
+                if record.get('gen', 0) != self._generation: # left by crash before journal of older file was removed
+                    continue
+                if 'put' in record:
+                    cells[record['put']['id']] = record['put']
+                else:
+                    cells.pop(record['rm'], None)
+        return list(cells.values())
 
     def load(self, data_json: None) -> None:
         """Create list of DataCell objects loaded from JSON. DB can be loaded from custom JSON, data_json=my_dict."""
-        if data_json == None:
-            data_json = self.get_json()
-        
-        self.data_cells = [DataCell(i) for i in data_json]
-        self.sort_cells()
-    
+        with self.lock, metrics.timer('load'):
+            self._changes = {}
+            self._lazy = False
+            if data_json == None:
+                self._needs_snapshot = False
+                if self.store is not None: # records are read when they are needed
+                    self._open_lazy(self.store)
+                    return
+                snapshot = self._open_snapshot()
+                if snapshot is not None:
+                    self._journal_records = snapshot.meta['journal_records']
+                    self._generation = snapshot.meta.get('generation', 0)
+                    self.backend.drop_prefetched() # files were read ahead for nothing
+                    self._open_lazy(snapshot)
+                    return
+                data_json = self.iter_json()
+            else:
+                self._needs_snapshot = True
+            self._fill(data_json)
+        if self._needs_snapshot:
+            self._changed()
+
+    def _fill(self, data_json) -> None:
+        """Replace cells with ones made from iterable of dictionaries, build indexes."""
+        self.data_cells = [DataCell(i) for i in data_json] # file is read, decrypted and parsed here
+        start = time.perf_counter()
+        self._index = {}
+        self._cell_grams = {}
+        self._cell_dedup = {}
+        self._dedup_counts = {}
+        self._cells_by_id = {}
+        no_id = [] # cells without id or with a duplicate one
+        for cell in self.data_cells:
+            self._index_cell(cell)
+            if isinstance(cell.id, int) and cell.id >= 0 and cell.id not in self._cells_by_id:
+                self._cells_by_id[cell.id] = cell
+            else:
+                no_id.append(cell)
+        self._next_id = max(self._cells_by_id, default=-1) + 1
+        self._free_ids = [] # gaps between sorted ids, a far away id costs one range, not one entry per missing id
+        previous = -1
+        for id in sorted(self._cells_by_id):
+            if id > previous + 1:
+                self._free_ids.append((previous + 1, id))
+            previous = id
+        heapq.heapify(self._free_ids)
+        self._sorted_ids = None
+        for cell in no_id:
+            cell.id = self.gen_id()
+            self._add_id(cell)
+            self._needs_snapshot = True
+        metrics.add_time('load.index', time.perf_counter() - start)
+        with metrics.timer('load.sort'):
+            self.sort_cells()
+        metrics.count('cells_loaded', len(self.data_cells))
+        self.version += 1
+
+    def _open_snapshot(self):
+        """Open read-only snapshot if it was made from current state of database files, else None."""
+        if self.snapshot_path is None or not path.exists(self.snapshot_path):
+            return None
+        from mmapsnapshot import MmapSnapshot
+        try:
+            snapshot = MmapSnapshot(self.snapshot_path)
+        except (OSError, ValueError):
+            return None
+        if snapshot.meta.get('state') is None or snapshot.meta['state'] != self.backend.state():
+            snapshot.close()
+            return None
+        snapshot.set_keys(self._get_keys())
+        return snapshot
+
+    def write_snapshot(self) -> None:
+        """Make read-only snapshot of current cells for fast next opening. Call after save(), it is valid only for current database files."""
+        if self.snapshot_path is None or self.store is not None:
+            return
+        with self.lock:
+            if self._lazy: # opened from snapshot and nothing was changed, it is still valid
+                return
+            state = self.backend.state()
+            if state is None or not self.backend.exists('snapshot') or self._changes or self._needs_snapshot: # files don't hold everything yet
+                return
+            old = self._open_snapshot()
+            if old is not None: # files were not changed since it was made
+                old.close()
+                return
+            cells = [i.to_dict() for i in self.data_cells]
+            meta = {'state': state, 'journal_records': self._journal_records, 'generation': self._generation}
+        import mmapsnapshot
+        with metrics.timer('save.snapshot'):
+            mmapsnapshot.write(self.snapshot_path, self._get_keys(), cells, meta)
+
+    def close(self) -> None:
+        """Close store or snapshot file, database must not be used after this."""
+        with self.lock:
+            if self._reader is not None and self._reader is not self.store:
+                self._reader.close()
+            self._reader = None
+            if self.store is not None:
+                self.store.close()
+
+    def _open_lazy(self, reader) -> None:
+        """Show records of reader (store or snapshot) through a lazy view, nothing is decrypted yet."""
+        self._get_cipher()
+        self._reader = reader
+        self._lazy = True
+        self.data_cells = LazyCells(reader)
+        self._sort_keys = _StoreKeys(reader)
+        self._cell_keys = {}
+        self._index = {}
+        self._cell_grams = {}
+        self._cell_dedup = {}
+        self._dedup_counts = {}
+        self._cells_by_id = {}
+        self._sorted_ids = None
+        self._store_pos = {}
+        self.version += 1
+
+    def _materialize(self) -> None:
+        """Read all records from store into memory. Needed before changes and search, lookups by id or name don't need it."""
+        if not self._lazy:
+            return
+        with self.lock:
+            if not self._lazy: # other thread did it
+                return
+            rows = list(self._reader.iter_rows())
+            if self._reader is self.store:
+                self._store_pos = {cell['id']: pos for pos, cell in rows}
+            else: # snapshot is not needed any more, file must not stay mapped while it is rewritten
+                self._reader.close()
+            self._reader = None
+            self._lazy = False
+            self._fill(cell for _, cell in rows)
+
     def initialize(self) -> None:
-        """Initialize database: create files & key."""
-        if not path.exists(path.dirname(DB_PATH)):
-            mkdir(path.dirname(DB_PATH))
-        key = Fernet.generate_key()
-        cipher = Fernet(key)
-        placeholder = cipher.encrypt(bytes('[]'.encode()))
-        with open(DB_KEY_PATH, 'wb') as key_file:
-            key_file.write(key)
-        with open(DB_PATH, 'wb') as data_file:
-            data_file.write(placeholder)
+        """Initialize database: create files & key (key file only if keys were not given)."""
+        self.backend.create()
+        if self.uses_key_file:
+            self._write_key_file([Fernet.generate_key()])
+        if self.store is not None:
+            self._get_cipher()
+            self.store.create()
+            self.store.write_all([])
+            return
+        self.backend.write('snapshot', [CHUNKED_HEADER + b' 0\n'])
+        self.backend.remove('journal')
+        self._generation = 0
 
     def save(self) -> None:
-        """Save data to file."""
-        list_of_dicts = []
-        for i in self.data_cells: # convert data from class objects to dictionaries
-            cell = {
-                "name": i.name,
-                "link": i.link,
-                "login": i.login,
-                "email": i.email,
-                "password": i.password,
-                "other_data": i.other_data,
-                "codes": i.codes,
-                "id": i.id
-            }
-            list_of_dicts.append(cell)
-        
-        with open(DB_KEY_PATH, 'r') as key_file:
-            key = key_file.readline()
-        cipher = Fernet(key)
-        bytes_data = bytes(json.dumps(list_of_dicts).encode())
-        encrypted_data = cipher.encrypt(bytes_data)
-        with open(DB_PATH, 'wb') as data_file:
-            data_file.write(encrypted_data)
+        """Save data to file. Can be called from another thread: cells are locked only while being serialized."""
+        if self.store is not None:
+            self._save_store()
+            return
+        if self._lazy: # opened from read-only snapshot
+            if not self._needs_snapshot: # nothing was read, so nothing was changed
+                return
+            self._materialize()
+        with self._save_lock, metrics.timer('save'):
+            with self.lock, metrics.timer('save.serialize'):
+                cipher = self._get_cipher()
+                compact = self._journal_records + len(self._changes) > max(JOURNAL_MIN_RECORDS, len(self.data_cells) * JOURNAL_RATIO)
+                snapshot = records = None
+                if not self.journal or self._needs_snapshot or compact:
+                    snapshot = [i.to_dict() for i in self.data_cells]
+                elif self._changes:
+                    records = [{'put': self._cells_by_id[id].to_dict()} if is_put else {'rm': id} for id, is_put in self._changes.items()]
+                self._changes = {}
+                self._needs_snapshot = False
+            try: # encryption and disk don't block changes
+                if snapshot is not None:
+                    self._save_snapshot(cipher, snapshot)
+                elif records:
+                    self._save_journal(cipher, records)
+            except Exception:
+                with self.lock: # changes are not in files, so write everything next time
+                    self._needs_snapshot = True
+                raise
+
+    def _save_store(self) -> None:
+        """Save to store. Only records of changed cells are encrypted and written."""
+        self._get_cipher()
+        if self._lazy and self._needs_snapshot: # e.g. new key: every record is rewritten
+            self._materialize()
+        with self._save_lock, metrics.timer('save'):
+            with self.lock, metrics.timer('save.serialize'):
+                if self._lazy: # nothing was read, so nothing was changed
+                    return
+                changes = None
+                full = self._needs_snapshot
+                if not full and self._changes:
+                    changes = self._store_changes()
+                    full = changes is None
+                if full:
+                    snapshot = [i.to_dict() for i in self.data_cells]
+                    self._store_pos = {cell.id: float(n) for n, cell in enumerate(self.data_cells)}
+                self._changes = {}
+                self._needs_snapshot = False
+            try: # encryption and disk don't block changes
+                if full:
+                    self.store.write_all(snapshot)
+                elif changes:
+                    self.store.apply(*changes)
+            except Exception:
+                with self.lock: # changes are not in store, so write everything next time
+                    self._needs_snapshot = True
+                raise
+
+    def _store_changes(self):
+        """Get (puts, removes) for store: (position, dictionary) of put cells and removed ids.
+        Put cells get positions evenly spaced between their unchanged neighbours. Returns None if there is no room (whole store is rewritten then)."""
+        removes = [id for id, is_put in self._changes.items() if not is_put]
+        for id in removes:
+            self._store_pos.pop(id, None)
+        indices = sorted(bisect_left(self._sort_keys, self._cell_keys[self._cells_by_id[id]]) for id, is_put in self._changes.items() if is_put)
+        puts = []
+        new_pos = {}
+        n = 0
+        while n < len(indices): # each run of neighbouring put cells goes between two unchanged cells
+            m = n
+            while m + 1 < len(indices) and indices[m + 1] == indices[m] + 1:
+                m += 1
+            first, last = indices[n], indices[m]
+            lo = self._store_pos[self.data_cells[first - 1].id] if first > 0 else None
+            hi = self._store_pos[self.data_cells[last + 1].id] if last + 1 < len(self.data_cells) else None
+            space = last - first + 2
+            if lo is None:
+                lo = (hi if hi is not None else 0.0) - space
+            if hi is None:
+                hi = lo + space
+            step = (hi - lo) / space
+            if step < 1e-6 * max(1.0, abs(lo)): # floats ran out of precision here
+                return None
+            for k in range(first, last + 1):
+                cell = self.data_cells[k]
+                new_pos[cell.id] = lo + step * (k - first + 1)
+                puts.append((new_pos[cell.id], cell.to_dict()))
+            n = m + 1
+        self._store_pos.update(new_pos)
+        return puts, removes
+
+    def move_to(self, store=None, backend: Backend=None) -> None:
+        """Move all cells to other storage: store (records) or backend (database file). Old one is left for caller to delete."""
+        self._get_cipher()
+        self._materialize()
+        with self.lock:
+            self.store = store
+            if backend is not None:
+                self.backend = backend
+            self._cipher = None
+            self._changes = {}
+            self._needs_snapshot = True
+        if store is not None:
+            self._get_cipher()
+            store.create()
+        else:
+            self.backend.create()
+        self.save()
+
+    def _save_snapshot(self, cipher: MultiFernet, list_of_dicts: list) -> None:
+        """Rewrite database file with all cells, drop journal."""
+        generation = self._generation + 1
+        self.backend.write('snapshot', self._snapshot_lines(cipher, list_of_dicts, generation))
+        self._generation = generation
+        # if we crash before this, journal records have older generation and are skipped on load
+        self.backend.remove('journal')
+        self._journal_records = 0
+
+    def _snapshot_lines(self, cipher: MultiFernet, list_of_dicts: list, generation: int):
+        """Lines of database file: header with generation, then encrypted chunks of cells."""
+        yield CHUNKED_HEADER + b' %d\n' % generation
+        chunks = (list_of_dicts[i:i+CHUNK_SIZE] for i in range(0, len(list_of_dicts), CHUNK_SIZE))
+        for line in self._map_chunks(partial(encrypt_chunk, cipher), chunks):
+            metrics.count('bytes_written', len(line))
+            yield line
+
+    def _save_journal(self, cipher: MultiFernet, records: list) -> None:
+        """Append records of changes to journal, one encrypted record per line."""
+        with metrics.timer('save.encrypt'):
+            lines = [cipher.encrypt(json.dumps(dict(i, gen=self._generation)).encode()) + b'\n' for i in records]
+        metrics.count('bytes_written', sum(len(i) for i in lines))
+        self.backend.append('journal', lines)
+        self._journal_records += len(lines)
+
+    async def load_async(self) -> None:
+        """Awaitable load(None): files are read concurrently, decryption runs in a worker thread."""
+        import asyncio
+        await self.backend.prefetch(['snapshot', 'journal'])
+        await asyncio.to_thread(self.load, None)
+
+    async def save_async(self) -> None:
+        """Awaitable save(), runs in a worker thread."""
+        import asyncio
+        await asyncio.to_thread(self.save)
 
     def sort_cells(self) -> None:
         """Sort database by source names"""
-        self.data_cells.sort(key=lambda x: x.name)
+        self.data_cells.sort(key=sort_key)
+        self._sort_keys = [sort_key(i) for i in self.data_cells]
+        self._cell_keys = dict(zip(self.data_cells, self._sort_keys))
+
+    def prefix_range(self, prefix: str) -> tuple:
+        """Get (start, end) slice of data_cells whose names start with prefix (case insensitive)."""
+        prefix = prefix.lower()
+        start = bisect_left(self._sort_keys, (prefix,))
+        end = bisect_left(self._sort_keys, (prefix + '\U0010ffff',))
+        return start, end
 
     def gen_id(self) -> int:
         """Generate valid id for element."""
-        # fetch already existing ones
-        ids = self.ids()
-        if not ids:
-            return 0
-        # fill holes
-        if min(ids) > 0: # if ... x1, x2, x3 indexes exist
-            return min(ids) -1
-        else:
-            for i in range(len(ids)-1):
-                if ids[i+1] != ids[i] + 1:
-                    return ids[i] + 1
-        return max(ids) + 1 # new one
-    
+        self._materialize()
+        while self._free_ids and self._free_ids[0][0] in self._cells_by_id: # skip ids taken since they were freed
+            first, stop = heapq.heappop(self._free_ids)
+            if first + 1 < stop:
+                heapq.heappush(self._free_ids, (first + 1, stop))
+        if self._free_ids: # fill holes
+            return self._free_ids[0][0]
+        return self._next_id # new one
+
+    def _add_id(self, cell: DataCell) -> None:
+        """Register cell in id index."""
+        self._cells_by_id[cell.id] = cell
+        self._sorted_ids = None
+        if cell.id >= self._next_id:
+            if cell.id > self._next_id: # skipped ids become a hole
+                heapq.heappush(self._free_ids, (self._next_id, cell.id))
+            self._next_id = cell.id + 1
+
     def rm(self, id: int) -> None:
         """Deletes data cell from database via id."""
-        cell = self.find_cell(id)
-        self.data_cells.remove(cell)
+        self._materialize()
+        with self.lock:
+            cell = self._cells_by_id.pop(id)
+            heapq.heappush(self._free_ids, (id, id + 1))
+            self._sorted_ids = None
+            self._drop_cell(cell)
+            self._changes[id] = False
+        self._changed()
+
+    def merge(self, data_json) -> tuple:
+        """Add cells from iterable of dictionaries, they get new ids. Cells with same name, login and link as existing ones are skipped. Returns (added, skipped)."""
+        self._materialize()
+        with self.lock:
+            seen = set() # keys of cells added by this import, existing ones are in self._dedup_counts
+            new_cells = []
+            skipped = 0
+            now = time.time()
+            for i in data_json: # nothing is changed until whole input is read, so a broken file changes nothing
+                cell = DataCell(i)
+                if cell.changed is None and cell.password: # age starts now, imported cells are not rotated as old ones
+                    cell.changed = now
+                key = dedup_key(cell)
+                if key in seen or key in self._dedup_counts:
+                    skipped += 1
+                    continue
+                seen.add(key)
+                new_cells.append(cell)
+            small = len(new_cells) * MERGE_INSERT_RATIO <= len(self.data_cells) # cost depends on import size, not vault size
+            for cell in new_cells:
+                cell.id = self.gen_id()
+                self._add_id(cell)
+                self._index_cell(cell)
+                self._changes[cell.id] = True
+                if small:
+                    self._insert_sorted(cell)
+            if not small:
+                self.data_cells.extend(new_cells)
+                self.sort_cells() # one sort instead of an insertion per cell
+        self._changed()
+        return len(new_cells), skipped
+
+    def _drop_cell(self, cell: DataCell) -> None:
+        """Remove cell from cell list and search index (id index is left to caller)."""
+        i = bisect_left(self._sort_keys, self._cell_keys.pop(cell))
+        del self._sort_keys[i]
+        del self.data_cells[i]
+        self._unindex_cell(cell)
     
     def ids(self) -> list:
         """Get sorted list of all existing ID's."""
-        return sorted([i.id for i in self.data_cells])
+        if self._lazy:
+            return self._reader.ids()
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self._cells_by_id)
+        return list(self._sorted_ids)
 
     def update(self, cell: DataCell) -> None:
         """Add new cell (already filled) to database."""
-        if cell.id in self.ids():
-            self.rm(cell.id)
-        self.data_cells.append(cell)
+        self._materialize()
+        with self.lock:
+            old = self._cells_by_id.get(cell.id)
+            if old is not None: # id stays taken, so it is not freed
+                self._drop_cell(old)
+            self._insert_sorted(cell)
+            self._index_cell(cell)
+            self._add_id(cell)
+            self._changes[cell.id] = True
+        self._changed()
+
+    def _insert_sorted(self, cell: DataCell) -> None:
+        """Put cell in its place in data_cells by binary search."""
+        key = sort_key(cell)
+        i = bisect_left(self._sort_keys, key)
+        self._sort_keys.insert(i, key)
+        self.data_cells.insert(i, cell)
+        self._cell_keys[cell] = key
+
+    def set_passwords(self, passwords: dict) -> None:
+        """Change passwords of many cells at once (id -> new password). Previous ones go to history of each cell."""
+        self._materialize()
+        with self.lock:
+            now = time.time()
+            for id, password in passwords.items():
+                cell = self._cells_by_id[id]
+                cell.set_password(password, now)
+                self._reindex_cell(cell) # name is not changed, so cell keeps its place
+                self._changes[id] = True
+        self._changed()
+
+    def _changed(self) -> None:
+        """Tell on_change listener that cells were changed."""
+        self.version += 1
+        if self.on_change is not None:
+            self.on_change()
 
     def find_cell(self, id: int) -> DataCell:
         """Find data cell by ID."""
-        for i in self.data_cells:
-            if i.id == id:
-                return i
+        if self._lazy:
+            cell = self._reader.find(id)
+            return DataCell(cell) if cell is not None else None
+        return self._cells_by_id.get(id)
+
+    def find_by(self, field: str, value: str) -> list:
+        """Find cells whose name, link or login equals value (case and surrounding spaces are ignored)."""
+        if self._lazy:
+            return [DataCell(i) for i in self._reader.find_by(field, value)]
+        value = value.strip().lower()
+        return [i for i in self.data_cells if getattr(i, field).strip().lower() == value]
     
-    def search_db(self, q: str, x: float=0.5) -> list:
-        """Search DB for matching things. x - indicator of similarity. Returns list with DataCells."""
-        result = []
-        q = q.lower()
-        temp = deepcopy(self.data_cells)
-        names = [i.name.lower() for i in temp]
-        links = [i.link.lower() for i in temp]
-        logins = [i.login.lower() for i in temp]
-        emails = [i.email.lower() for i in temp]
-        passwords = [i.password.lower() for i in temp]
-        other_datas = [i.other_data.lower() for i in temp]
-        codes = [i.codes.lower() for i in temp]
-        everything = names + links + logins + emails + passwords + other_datas + codes
-        match_result = difflib.get_close_matches(q, everything, cutoff=x)
-        for i in temp:
-            if (i.name.lower() or i.link.lower() or i.login.lower() or i.email.lower() or i.password.lower() or i.other_data.lower() or i.codes.lower()) in match_result:
-                result.append(i)
-        return result
-
-    def export_db(self, output_dir: str, export_format: str='xlsx') -> None:
-        """Export database in a convenient format."""
+    def _cell_ngrams(self, cell: DataCell) -> set:
+        """Get n-grams of all searchable fields of cell."""
+        grams = set()
+        for field in FIELDS:
+            value = getattr(cell, field)
+            if value:
+                grams |= ngrams(value)
+        return grams
+
+    def _index_cell(self, cell: DataCell) -> None:
+        """Add cell to search and dedup indexes."""
+        grams = self._cell_ngrams(cell)
+        for gram in grams:
+            self._index.setdefault(gram, set()).add(cell)
+        self._cell_grams[cell] = grams
+        key = dedup_key(cell)
+        self._cell_dedup[cell] = key
+        self._dedup_counts[key] = self._dedup_counts.get(key, 0) + 1
+
+    def _reindex_cell(self, cell: DataCell) -> None:
+        """Update search index of cell edited in place. Only n-grams that appeared or disappeared are touched."""
+        old = self._cell_grams.get(cell, set())
+        new = self._cell_ngrams(cell)
+        for gram in old - new:
+            cells = self._index[gram]
+            cells.discard(cell)
+            if not cells:
+                del self._index[gram]
+        for gram in new - old:
+            self._index.setdefault(gram, set()).add(cell)
+        self._cell_grams[cell] = new
+
+    def _unindex_cell(self, cell: DataCell) -> None:
+        """Remove cell from search and dedup indexes."""
+        for gram in self._cell_grams.pop(cell, ()):
+            cells = self._index[gram]
+            cells.discard(cell)
+            if not cells:
+                del self._index[gram]
+        key = self._cell_dedup.pop(cell, None)
+        if key is not None:
+            self._dedup_counts[key] -= 1
+            if not self._dedup_counts[key]:
+                del self._dedup_counts[key]
+
+    def rank(self, q: str, x: float=0.5, k: int=None) -> list:
+        """Search DB, x - indicator of similarity, k - how many best results to return (all if None). Returns list of (score, DataCell), best first."""
+        self._materialize()
+        if self._search_cache_version != self.version:
+            self._search_cache.clear()
+            self._search_cache_version = self.version
+        key = (q.lower(), x)
+        start = time.perf_counter()
+        if key in self._search_cache:
+            self.search_stats['hits'] += 1
+            self._search_cache.move_to_end(key)
+            result = self._search_cache[key]
+        else:
+            # same query with lower x found a superset of cells, only they are scored again
+            looser = [i for i in self._search_cache if i[0] == key[0] and i[1] < x]
+            if looser:
+                self.search_stats['refined'] += 1
+                candidates = [cell for _, cell in self._search_cache[max(looser)]]
+            else:
+                self.search_stats['misses'] += 1
+                candidates = self._candidates(q, x)
+            metrics.count('search.cells_scanned', len(candidates))
+            result = rank(q, candidates, x)
+            self._search_cache[key] = result
+            if len(self._search_cache) > self.search_cache_size:
+                self._search_cache.popitem(last=False)
+        metrics.add_time('search', time.perf_counter() - start)
+        return result[:k] if k is not None else list(result)
+
+    def search_cache_info(self) -> dict:
+        """Get search cache size and hit/refine/miss counters."""
+        return dict(self.search_stats, size=len(self._search_cache), max_size=self.search_cache_size)
+
+    def _candidates(self, q: str, x: float) -> set:
+        """Get cells that can reach similarity x with query. A text within d edits of query shares at least len(q) + 1 - 3d
+        of its n-grams (one of them may be the dropped first-letter gram). If that bound doesn't stay above zero, all cells are candidates.
+        Texts containing query score without edits, they share its inner n-grams, so query must have some (3+ characters)."""
+        # text longer than query needs len(text) <= len(q) / x, so at most (1 - x) * len(q) / x edits are allowed
+        max_edits = int((1 - x) * len(q) / x + EPSILON) if x > 0 else len(q)
+        if len(q) < 3 or len(q) - 3 * max_edits < 1: # short queries and low x
+            return self.data_cells
+        grams = ngrams(q)
+        if len(q) >= 3: # "  a" (first letter) is shared by a big part of database but alone never makes a good match
+            grams.discard('  ' + q[0].lower())
+        candidates = set()
+        for gram in grams:
+            candidates |= self._index.get(gram, set())
+        return candidates
+
+    def search_db(self, q: str, x: float=0.5, k: int=None) -> list:
+        """Search DB for matching things. x - indicator of similarity. Returns list with DataCells, best matches first."""
+        return [cell for _, cell in self.rank(q, x, k)]
+
+    def export_db(self, output_dir: str, export_format: str='xlsx', cells: list=None, name: str='database', columns: dict=None) -> None:
+        """Export database (or given cells, e.g. a report) in a convenient format. Rows are written straight from cells, one at a time.
+        columns - extra report columns after cell fields: name -> list of values, one per cell."""
         if export_format not in self.export_formats:
             print(f'Format {export_format} is not in available lists.')
             return
-        data_json = self.get_json()
-        filename = 'database.' + export_format
+        if cells is None:
+            cells = self.data_cells
+        columns = columns or {}
+        filename = f'{name}.' + export_format
         index = 1
         while path.exists(path.join(output_dir, filename)): # find name that is not already taken
-                filename = f'database ({index}).' + export_format
+                filename = f'{name} ({index}).' + export_format
                 index += 1
+        file_path = path.join(output_dir, filename)
+        start = time.perf_counter()
         if export_format == 'xlsx':
-            df = pd.DataFrame(data_json)
-            df.to_excel(path.join(output_dir, filename), header=['Resource', 'Link', 'Login', 'Email', 'Password', 'Other data', 'Codes', 'ID in database'], index=False)
+            from openpyxl import Workbook
+            wb = Workbook(write_only=True) # rows are streamed to file instead of kept as cell objects
+            ws = wb.create_sheet()
+            ws.append(EXPORT_HEADER + [i.capitalize() for i in columns])
+            for n, cell in enumerate(cells):
+                ws.append([getattr(cell, i) for i in FIELDS] + [cell.id] + [i[n] for i in columns.values()])
+            wb.save(file_path)
         
-        elif export_format == 'json':
-            with open(path.join(output_dir, filename), 'w') as f:
-                json.dump(data_json, f, indent=4)
+        elif export_format == 'json': # same output as json.dump(..., indent=4) of whole list
+            with open(file_path, 'w') as f:
+                f.write('[')
+                for n, cell in enumerate(cells):
+                    f.write(',\n    ' if n else '\n    ')
+                    f.write(json.dumps(dict(cell.to_dict(), **{k: v[n] for k, v in columns.items()}), indent=4).replace('\n', '\n    '))
+                f.write('\n]' if cells else ']')
+
+        elif export_format == 'csv':
+            import csv
+            with open(file_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(EXPORT_HEADER + [i.capitalize() for i in columns])
+                for n, cell in enumerate(cells):
+                    writer.writerow([getattr(cell, i) for i in FIELDS] + [cell.id] + [i[n] for i in columns.values()])
+
+        elif export_format == 'ndjson': # one cell per line
+            with open(file_path, 'w', encoding='utf-8') as f:
+                for n, cell in enumerate(cells):
+                    f.write(json.dumps(dict(cell.to_dict(), **{k: v[n] for k, v in columns.items()})) + '\n')
         
+        seconds = time.perf_counter() - start
+        metrics.add_time('export.' + export_format, seconds)
         print(f'Exported as "{filename}"!')
+        print(f'{len(cells)} entries in {seconds:.2f} s ({len(cells) / max(seconds, 1e-9):.0f} entries/s).')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,79 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+
+DEFAULT_COST = {'n': 2**15, 'r': 8, 'p': 1}
+MIN_N = 2**14 # cost is never calibrated below this
+MAX_N = 2**17 # 128 MiB of memory with r=8, more cost goes to p (time only)
+CHECK_TEXT = b'psm vault' # encrypted with derived key to tell if password is right
+
+_cache = {} # derived keys of this process, KDF cost is paid once per session
+_cache_secret = os.urandom(32) # passwords are not kept in cache, only their HMAC with this
+
+
+def derive_key(password: str, params: dict) -> bytes:
+    """Derive Fernet key from password with scrypt."""
+    cache_key = (params['salt'], params['n'], params['r'], params['p'], hmac.new(_cache_secret, password.encode(), hashlib.sha256).digest())
+    if cache_key not in _cache:
+        kdf = Scrypt(salt=base64.b64decode(params['salt']), length=32, n=params['n'], r=params['r'], p=params['p'])
+        _cache[cache_key] = base64.urlsafe_b64encode(kdf.derive(password.encode()))
+    return _cache[cache_key]
+
+
+def create(password: str, cost: dict=DEFAULT_COST) -> tuple:
+    """Create KDF parameters with new salt for password. Returns (params, key)."""
+    params = {'kdf': 'scrypt', 'salt': base64.b64encode(os.urandom(16)).decode(), 'n': cost['n'], 'r': cost['r'], 'p': cost['p']}
+    key = derive_key(password, params)
+    params['check'] = Fernet(key).encrypt(CHECK_TEXT).decode()
+    return params, key
+
+
+def unlock(password: str, params_list: list) -> list:
+    """Get keys of all parameter sets this password is right for, newest first."""
+    keys = []
+    for params in params_list:
+        key = derive_key(password, params)
+        try:
+            if Fernet(key).decrypt(params['check'].encode()) == CHECK_TEXT:
+                keys.append(key)
+        except InvalidToken:
+            continue
+    return keys
+
+
+def load_params(file_path: str) -> list:
+    """Load list of KDF parameter sets (current first) from vault file."""
+    with open(file_path) as f:
+        return json.load(f)['keys']
+
+
+def save_params(file_path: str, params_list: list) -> None:
+    """Save list of KDF parameter sets (current first) to vault file."""
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'keys': params_list}, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, file_path)
+
+
+def calibrate(target: float=0.5) -> dict:
+    """Find scrypt cost for which deriving a key takes about target seconds on this machine."""
+    n, r = MIN_N, 8
+    start = time.perf_counter()
+    Scrypt(salt=os.urandom(16), length=32, n=n, r=r, p=1).derive(b'calibration')
+    factor = target / (time.perf_counter() - start) # time grows linearly with both n and p
+    while factor >= 2 and n < MAX_N:
+        n *= 2
+        factor /= 2
+    return {'n': n, 'r': r, 'p': max(1, round(factor))}
+
+
+if __name__ == '__main__':
+    print("The kdf library file cannot be started.")
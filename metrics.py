@@ -0,0 +1,64 @@
+import threading
+import time
+from contextlib import nullcontext
+
+
+enabled = False # when off, timer() returns a shared no-op context and count() returns at once
+timers = {} # name -> [calls, seconds]
+counters = {} # name -> number
+_lock = threading.Lock() # chunks are decrypted/encrypted in worker threads
+_null = nullcontext()
+
+
+class _Timer:
+    """Context manager adding its run time to a named timer."""
+    __slots__ = ['name', 'start']
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        add_time(self.name, time.perf_counter() - self.start)
+
+
+def timer(name: str):
+    """Time a block: with metrics.timer('save.encrypt'): ..."""
+    return _Timer(name) if enabled else _null
+
+
+def add_time(name: str, seconds: float) -> None:
+    """Add measured time to a named timer."""
+    if enabled:
+        with _lock:
+            t = timers.setdefault(name, [0, 0.0])
+            t[0] += 1
+            t[1] += seconds
+
+
+def count(name: str, n: int=1) -> None:
+    """Add n to a named counter."""
+    if enabled:
+        with _lock:
+            counters[name] = counters.get(name, 0) + n
+
+
+def reset() -> None:
+    """Forget everything measured so far."""
+    with _lock:
+        timers.clear()
+        counters.clear()
+
+
+def report() -> list:
+    """Lines with all timers (slowest first) and counters."""
+    with _lock:
+        lines = [f'{name:<24} {calls:>8} calls {seconds * 1000:>11.1f} ms' for name, (calls, seconds) in sorted(timers.items(), key=lambda i: -i[1][1])]
+        lines += [f'{name:<24} {n:>8}' for name, n in sorted(counters.items())]
+    return lines
+
+
+if __name__ == '__main__':
+    print("The metrics library file cannot be started.")
@@ -0,0 +1,149 @@
+import json
+import mmap
+import os
+from bisect import bisect_left
+import struct
+import metrics
+from storage import RecordCipher
+
+
+HEADER = b'PSM-SNAPSHOT-1\n'
+ENTRY = struct.Struct('<qQI') # cell id, record offset, record length; in name order
+ID_ENTRY = struct.Struct('<qI') # cell id, position in name order; sorted by id
+META_SIZE = struct.Struct('<I')
+
+
+class _Ids:
+    """Ids of id table, for bisect."""
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self) -> int:
+        return self.snapshot.count()
+
+    def __getitem__(self, i: int) -> int:
+        return ID_ENTRY.unpack_from(self.snapshot._map, self.snapshot._id_table + i * ID_ENTRY.size)[0]
+
+
+class MmapSnapshot:
+    """Read-only copy of database: tables of record offsets plus separately encrypted records, opened with mmap.
+    Only records that are accessed are read from disk and decrypted. Made by write(), never changed after that."""
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._cipher = None
+        try:
+            self._read_header()
+        except (ValueError, struct.error, TypeError, KeyError): # truncated or damaged file
+            self.close()
+            raise ValueError('Not a snapshot file.')
+
+    def _read_header(self) -> None:
+        """Read meta and find tables, check that they fit in file."""
+        if self._map[:len(HEADER)] != HEADER:
+            raise ValueError
+        size, = META_SIZE.unpack_from(self._map, len(HEADER))
+        start = len(HEADER) + META_SIZE.size
+        if start + size > len(self._map):
+            raise ValueError
+        self.meta = json.loads(self._map[start:start+size]) # state of database files it was made from
+        self._table = start + size
+        self._id_table = self._table + self.count() * ENTRY.size
+        if self.count() < 0 or self._id_table + self.count() * ID_ENTRY.size > len(self._map):
+            raise ValueError
+        if self.count(): # records are written in table order, so last one ends the file
+            _, offset, length = ENTRY.unpack_from(self._map, self._table + (self.count() - 1) * ENTRY.size)
+            if offset + length > len(self._map):
+                raise ValueError
+
+    def set_keys(self, keys: list) -> None:
+        """Database keys, newest first."""
+        self._cipher = RecordCipher(keys)
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def count(self) -> int:
+        return int(self.meta['count'])
+
+    def _record(self, i: int) -> dict:
+        """Decrypt cell at position i."""
+        id, offset, length = ENTRY.unpack_from(self._map, self._table + i * ENTRY.size)
+        with metrics.timer('load.decrypt'):
+            cell = json.loads(self._cipher.decrypt(id, self._map[offset:offset+length]))
+        cell['id'] = id
+        metrics.count('cells_decrypted')
+        return cell
+
+    def cells(self, start: int, stop: int) -> list:
+        """Cell dictionaries at positions start..stop-1 in name order."""
+        return [self._record(i) for i in range(max(0, start), min(stop, self.count()))]
+
+    def sort_key_at(self, i: int) -> tuple:
+        """(lowercase name, id) of cell at position i."""
+        cell = self._record(i)
+        return cell['name'].lower(), cell['id']
+
+    def find(self, id: int) -> dict:
+        """Cell dictionary by id, None if there is none. Binary search in id table."""
+        if not isinstance(id, int): # id table holds only ints
+            return None
+        i = bisect_left(_Ids(self), id)
+        if i == self.count():
+            return None
+        found, pos = ID_ENTRY.unpack_from(self._map, self._id_table + i * ID_ENTRY.size)
+        return self._record(pos) if found == id else None
+
+    def find_by(self, field: str, value: str) -> list:
+        """Cells whose field equals value (case insensitive). Snapshot has no hash index, every record is decrypted."""
+        value = value.strip().lower()
+        return [cell for _, cell in self.iter_rows() if cell.get(field, '').strip().lower() == value]
+
+    def ids(self) -> list:
+        return [ID_ENTRY.unpack_from(self._map, self._id_table + i * ID_ENTRY.size)[0] for i in range(self.count())]
+
+    def iter_rows(self):
+        """(position, cell dictionary) of all records in name order."""
+        for i in range(self.count()):
+            yield float(i), self._record(i)
+
+
+def is_current(file_path: str, state: list) -> bool:
+    """Does snapshot file exist and was made from database files in given state. Only header is read, no keys are needed."""
+    try:
+        snapshot = MmapSnapshot(file_path)
+    except (OSError, ValueError):
+        return False
+    current = state is not None and snapshot.meta.get('state') == state
+    snapshot.close()
+    return current
+
+
+def write(file_path: str, keys: list, cells: list, meta: dict) -> None:
+    """Write snapshot of cell dictionaries (in name order). meta is kept in snapshot as is (plus count)."""
+    cipher = RecordCipher(keys)
+    records = []
+    for cell in cells:
+        records.append(cipher.encrypt(cell['id'], json.dumps({k: v for k, v in cell.items() if k != 'id'}).encode()))
+    meta = json.dumps(dict(meta, count=len(cells))).encode()
+    offset = len(HEADER) + META_SIZE.size + len(meta) + len(cells) * (ENTRY.size + ID_ENTRY.size)
+    table = []
+    for cell, record in zip(cells, records):
+        table.append(ENTRY.pack(cell['id'], offset, len(record)))
+        offset += len(record)
+    id_table = [ID_ENTRY.pack(id, pos) for id, pos in sorted((cell['id'], pos) for pos, cell in enumerate(cells))]
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER + META_SIZE.pack(len(meta)) + meta)
+        f.write(b''.join(table))
+        f.write(b''.join(id_table))
+        f.write(b''.join(records))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, file_path)
+
+
+if __name__ == '__main__':
+    print("The mmapsnapshot library file cannot be started.")
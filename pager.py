@@ -0,0 +1,57 @@
+import sys
+
+
+CLEAR = '\033[2J\033[H' # clear screen, cursor to top left corner
+
+
+def clear_screen() -> None:
+    """Clear console with ANSI sequence (no shell process is started)."""
+    sys.stdout.write(CLEAR)
+    sys.stdout.flush()
+
+
+def format_cell(cell, show_id: bool) -> str:
+    """Data cell content as text, one field per line."""
+    name = '\033[32mname\033[0m' if show_id else 'name'
+    lines = [
+        '----------',
+        f'{name}:       {cell.name}',
+        f'link:       {cell.link}',
+        f'login:      {cell.login}',
+        f'email:      {cell.email}',
+        f'password:   {cell.password}',
+        f'other data: {cell.other_data}',
+        f'codes:      {cell.codes}'
+    ]
+    if show_id:
+        lines.append(f'\033[35mid\033[0m:         {cell.id}')
+    lines.append('----------')
+    return '\n'.join(lines) + '\n'
+
+
+class Pager:
+    """Splits sorted cells into pages. Only cells of requested page are touched, so page count does not matter."""
+    def __init__(self, cells: list, psize: int=2):
+        self.cells = cells
+        self.psize = max(1, psize)
+
+    def page_amount(self) -> int:
+        """Number of pages, last one may be not full."""
+        return -(-len(self.cells) // self.psize)
+
+    def render(self, page: int, header: str='') -> str:
+        """Whole page as one string: header, entry count, cells and page number."""
+        parts = [header, f'{len(self.cells)} entries\n']
+        for cell in self.cells[page*self.psize:(page+1)*self.psize]:
+            parts.append(format_cell(cell, True))
+        parts.append(f'[{page + 1}/{self.page_amount()}]\n')
+        return ''.join(parts)
+
+    def show(self, page: int, header: str='', clear: bool=False) -> None:
+        """Write page to console in one call."""
+        sys.stdout.write((CLEAR if clear else '') + self.render(page, header))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    print("The pager library file cannot be started.")
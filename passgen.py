@@ -0,0 +1,99 @@
+import secrets
+import string
+
+
+CLASSES = {
+    'lower': string.ascii_lowercase,
+    'upper': string.ascii_uppercase,
+    'digits': string.digits,
+    'punctuation': string.punctuation
+}
+# share of password length for each class: 1/6 - punctuation, 2/6 - digits, 3/6 - letters
+DEFAULT_POLICY = {'punctuation': 1/6, 'digits': 2/6, 'lower': 1/4, 'upper': 1/4}
+
+_rng = secrets.SystemRandom() # CSPRNG, for shuffles longer than one byte can index
+_tables = {} # alphabet -> (translate table, rejected bytes)
+
+
+def class_counts(length: int, policy: dict=DEFAULT_POLICY) -> dict:
+    """How many characters of each class a password of given length gets.
+    Shares are rounded by largest remainder, every class gets at least one character if length allows."""
+    if any(i not in CLASSES for i in policy):
+        raise ValueError(f'Unknown character class, use: {", ".join(CLASSES)}')
+    classes = [i for i in policy if policy[i] > 0]
+    if not classes:
+        raise ValueError('Policy has no character classes.')
+    total = sum(policy[i] for i in classes)
+    exact = {i: length * policy[i] / total for i in classes}
+    counts = {i: int(exact[i]) for i in classes}
+    for i in sorted(classes, key=lambda i: exact[i] - counts[i], reverse=True)[:length - sum(counts.values())]:
+        counts[i] += 1
+    for i in classes:
+        if counts[i] == 0 and length >= len(classes):
+            counts[max(counts, key=counts.get)] -= 1
+            counts[i] = 1
+    return counts
+
+
+def _table(alphabet: str) -> tuple:
+    """Byte translation table for alphabet. Bytes above the largest multiple of len(alphabet) are rejected, so every character is equally likely."""
+    if alphabet not in _tables:
+        limit = 256 - 256 % len(alphabet)
+        table = bytes(ord(alphabet[i % len(alphabet)]) for i in range(limit)) + bytes(256 - limit)
+        _tables[alphabet] = (table, bytes(range(limit, 256)))
+    return _tables[alphabet]
+
+
+def random_chars(alphabet: str, k: int) -> str:
+    """k uniformly random characters of alphabet. Random bytes are mapped in bulk with bytes.translate, not one by one."""
+    table, rejected = _table(alphabet)
+    result = b''
+    while len(result) < k:
+        need = k - len(result)
+        result += secrets.token_bytes(need + need * len(rejected) // (256 - len(rejected)) + 16).translate(table, rejected)
+    return result[:k].decode()
+
+
+def _random_bytes():
+    """Endless iterator of random bytes, read from CSPRNG in blocks."""
+    while True:
+        yield from secrets.token_bytes(4096)
+
+
+def shuffle(x: list, rnd=None) -> None:
+    """Fisher-Yates shuffle in place, linear time. Indexes come from random bytes by rejection, so all orders are equally likely."""
+    if len(x) > 256:
+        _rng.shuffle(x)
+        return
+    rnd = rnd or _random_bytes()
+    for i in range(len(x) - 1, 0, -1):
+        limit = 256 - 256 % (i + 1)
+        b = next(rnd)
+        while b >= limit:
+            b = next(rnd)
+        j = b % (i + 1)
+        x[i], x[j] = x[j], x[i]
+
+
+def generate_batch(n: int, length: int, policy: dict=DEFAULT_POLICY) -> list:
+    """Generate n passwords of given length. Characters of each class are drawn for the whole batch at once."""
+    counts = class_counts(length, policy)
+    pools = {i: random_chars(CLASSES[i], counts[i] * n) for i in counts}
+    rnd = _random_bytes()
+    passwords = []
+    for j in range(n):
+        chars = []
+        for i, count in counts.items():
+            chars.extend(pools[i][j*count:(j+1)*count])
+        shuffle(chars, rnd)
+        passwords.append(''.join(chars))
+    return passwords
+
+
+def generate(length: int, policy: dict=DEFAULT_POLICY) -> str:
+    """Create a string of random letters (uppercase and lowercase), numbers and special characters."""
+    return generate_batch(1, length, policy)[0]
+
+
+if __name__ == '__main__':
+    print("The passgen library file cannot be started.")
@@ -1,40 +1,101 @@
 import os
+import sys
 from os import path
-from database import Database, DataCell
+import argparse
+from database import Database, DataCell, FIELDS, read_table
+from ranking import Matcher, EPSILON
+from autosave import AutoSaver
+from storage import Backend, FileBackend, prefetch_in_background
+from pager import Pager, clear_screen, format_cell
+import kdf
+import passgen
+import audit
+import mmapsnapshot
+import metrics
 import re
-from cryptography.fernet import Fernet
-from random import choice, randint
-import string
+from cryptography.fernet import Fernet, InvalidToken
 from getpass import getpass
+from zipfile import BadZipFile
 import json
+import time
 
 
-def main() -> None:
-    PSM_VERSION = '1.0.2'
+IMPORT_FORMATS = ['1.0.0', '1.0.2', 'csv', 'xlsx']
+STORAGE_FORMATS = ['dat', 'sqlite']
+PROFILE_PATH = 'psm.prof' # cProfile output of --profile, open with pstats or snakeviz
+ROTATE_FIELDS = ['name', 'link', 'login'] # rotate query is matched only against these, not passwords or notes
+UNLOCK_TIME = 0.5 # seconds password key derivation is calibrated to
+AUDIT_SHOW = 10 # groups (or weak cells) of each issue printed by audit, report file has all of them
+
+
+def set_paths() -> None:
+    """Set paths of data files and go to psm directory, they are relative to it."""
     global PF_PATH
-    PF_PATH = 'data.dat' # password file
+    PF_PATH = 'data.dat' # password file (1.1.0 and older)
     global KEY_PATH
-    KEY_PATH = 'key.dat' # password encryption 
+    KEY_PATH = 'key.dat' # password encryption (1.1.0 and older)
     global DB_PATH
     DB_PATH = path.join('data', 'database.dat')
+    global SQLITE_PATH
+    SQLITE_PATH = path.join('data', 'database.sqlite') # used instead of DB_PATH after "migrate sqlite"
+    global SNAPSHOT_PATH
+    SNAPSHOT_PATH = path.join('data', 'database.snap') # read-only copy of database for fast opening, made on exit
     global DB_KEY_PATH
-    DB_KEY_PATH = path.join('data', 'key.dat')
+    DB_KEY_PATH = path.join('data', 'key.dat') # database key (1.1.0 and older)
+    global VAULT_PATH
+    VAULT_PATH = path.join('data', 'vault.json') # parameters to derive database key from password
     os.chdir(path.dirname(path.realpath(__file__)))
+
+
+def open_database(keys: list, backend: Backend=None) -> Database:
+    """Create database object for psm data files and load it."""
+    store = None
+    if path.exists(SQLITE_PATH):
+        if path.exists(DB_PATH): # migration was interrupted, database file is still complete
+            os.remove(SQLITE_PATH)
+        else:
+            from sqlstore import SqliteStore
+            store = SqliteStore(SQLITE_PATH)
+    db = Database(db_path=DB_PATH, key_path=DB_KEY_PATH, journal=True, workers=os.cpu_count() or 1, keys=keys, backend=backend, store=store, snapshot_path=SNAPSHOT_PATH)
+    db.load(None)
+    if path.exists(DB_KEY_PATH): # finish moving from key file to password-derived key
+        db.reencrypt(keys[0])
+        os.remove(DB_KEY_PATH)
+    return db
+
+
+def main() -> None:
+    PSM_VERSION = '1.2.0'
+    set_paths()
     check_for_data()
-    log_in()
+    backend = FileBackend(DB_PATH)
+    reading = None
+    if not mmapsnapshot.is_current(SNAPSHOT_PATH, backend.state()): # otherwise database files are not read at all
+        reading = prefetch_in_background(backend) # database files are read while password is typed
+    keys = log_in()
+    if reading is not None:
+        reading.join()
     global database
-    database = Database(db_path=DB_PATH, key_path=DB_KEY_PATH)
-    database.load(None)
+    database = open_database(keys, backend)
+    global autosaver
+    autosaver = AutoSaver(database) # changes are saved in background, prompt never waits for disk
+    autosaver.start()
 
     command = ''
-    os.system('cls')
+    if os.name == 'nt':
+        os.system('') # turns on ANSI sequences in Windows console
+    clear_screen()
     print(f'PSM version {PSM_VERSION}')
     while True:
         print()
         print('Commands: help, show [int], search [str] [float], new, edit, delete, export, save, exit, admin.')
         command = input('> ').lower().strip()
-        os.system('cls')
+        start = time.perf_counter()
+        clear_screen()
         print(f'> {command}')
+        if autosaver.error is not None:
+            print(f'Autosave failed: {autosaver.error}')
+            autosaver.error = None
         if command == 'help':
             help_function()
         elif command.startswith('show'):
@@ -44,7 +105,6 @@ def main() -> None:
             print('Creating new data cell.')
             cell = new_cell()
             database.update(cell)
-            database.save()
             print(f'Saved with ID {cell.id}!')
         elif command == 'edit':
             print('Editing data cell.')
@@ -52,7 +112,6 @@ def main() -> None:
             if not is_cancelled:
                 cell = edit_cell(cell_id)
                 database.update(cell)
-                database.save()
                 print('Saved!')
             else:
                 print('Cancelled.')
@@ -75,31 +134,72 @@ def main() -> None:
                     print('Cancelled.')
             else:
                 print('Cancelled.')
-        elif command.startswith('search'):
+        elif command.split()[:1] == ['search']: # not search_stats
             search(command)
         elif command == 'save':
-            database.save()
+            autosaver.flush()
             print('Database saved!')
         elif command == 'exit':
             break
         elif command == 'admin':
-            print('Admin commands: chpassword, delete_data, 1.0.0_import')
+            print('Admin commands: chpassword, rotate_key, delete_data, import, 1.0.0_import, 1.0.2_import, search_stats, kdf_calibrate, rotate, audit, stats, migrate')
         elif command == 'chpassword':
             change_password()
+        elif command == 'search_stats':
+            stats = database.search_cache_info()
+            print(f'Search cache: {stats["size"]}/{stats["max_size"]} queries.')
+            print(f'Hits: {stats["hits"]}, refined: {stats["refined"]}, misses: {stats["misses"]}.')
+        elif command == 'rotate_key':
+            p = input('Enter password: ')
+            if unlock(p):
+                rekey(p)
+                print('Database key changed!')
+            else:
+                print('Wrong password. Cancelled.')
+        elif command == 'kdf_calibrate':
+            calibrate_kdf()
+        elif command == 'rotate':
+            rotate_command()
+        elif command == 'audit':
+            audit_command()
         elif command == 'delete_data':
             delete_data()
+        elif command == 'import':
+            version, is_cancelled = choose_from(IMPORT_FORMATS, 'format')
+            if not is_cancelled:
+                db_dir, is_cancelled = enter_dir(True)
+            if not is_cancelled:
+                import_db(db_dir, version)
+            else:
+                print('Cancelled.')
         elif command == '1.0.0_import':
             db_dir, is_cancelled = enter_dir(True)
             if not is_cancelled:
                 import_db(db_dir, '1.0.0')
-                database.save()
             else:
                 print('Cancelled.')
+        elif command == '1.0.2_import':
+            db_dir, is_cancelled = enter_dir(True)
+            if not is_cancelled:
+                import_db(db_dir, '1.0.2')
+            else:
+                print('Cancelled.')
+        elif command == 'migrate':
+            to, is_cancelled = choose_from(STORAGE_FORMATS, 'format')
+            if not is_cancelled:
+                autosaver.flush()
+                migrate(to)
+            else:
+                print('Cancelled.')
+        elif command.startswith('stats'):
+            stats_command(command)
         else:
             print(f'No such command "{command}".')
+        metrics.add_time('command.' + (command.split()[0] if command else ''), time.perf_counter() - start) # prompts inside command are counted too
 
-    database.save()
-    save_password(load_password()) # updates encryption
+    autosaver.stop() # saves what is left
+    database.write_snapshot()
+    database.close()
 
 
 def help_function() -> None:
@@ -108,6 +208,8 @@ def help_function() -> None:
     print('\033[31mshow\033[0m')
     print('Show database content. Usage: show [i: int], i - how many results to show at one time.')
     print('You can type "b" to go to the previous page.')
+    print('You can type "/<text>" to jump to the page with first name starting with text.')
+    print('You can type page number to jump to that page.')
     # search
     print('\033[31msearch\033[0m')
     print('Search in database by word. Usage: search [query: str] [i: float], query - what to search for, i - indicator of similarity.')
@@ -123,26 +225,54 @@ def help_function() -> None:
     print('Delete data cell (cell is defined by ID). Usage: delete.')
     # export
     print('\033[31mexport\033[0m')
-    print('Export database as .xlsx or .json file to folder user gives. Usage: export.')
+    print('Export database as .xlsx, .json, .csv or .ndjson file to folder user gives. Usage: export.')
     print('Note: .json will be 1.0.0 file format.')
     # save
     print('\033[31msave\033[0m')
-    print('Save database. Usage: save.')
+    print('Save database now (changes are also saved automatically in a second). Usage: save.')
     # exit
     print('\033[31mexit\033[0m')
-    print('ALWAYS run this command when you want to exit an app, otherwise database won\'t be updated. Usage: exit.')
+    print('ALWAYS run this command when you want to exit an app, otherwise last changes may be lost. Usage: exit.')
     # admin
     print('\033[31madmin\033[0m')
     print('Shows administration commands:')
     # chpassword
     print('  \033[31mchpassword\033[0m')
     print('  Change password to enter this app. Usage: chpassword.')
+    # rotate_key
+    print('  \033[31mrotate_key\033[0m')
+    print('  Re-encrypt database with a new key (derived from same password with new salt). Usage: rotate_key.')
+    # kdf_calibrate
+    print('  \033[31mkdf_calibrate\033[0m')
+    print('  Choose how hard password key is to compute, so unlocking takes given time on this computer. Usage: kdf_calibrate.')
+    # search_stats
+    print('  \033[31msearch_stats\033[0m')
+    print('  Show how often search results were taken from cache. Usage: search_stats.')
+    # stats
+    print('  \033[31mstats\033[0m')
+    print('  Show time spent in each phase of load, save, search and commands. Usage: stats [on/off/reset], metrics are collected after "stats on" or when started with --profile.')
+    # migrate
+    print('  \033[31mmigrate\033[0m')
+    print('  Move database to SQLite file (sqlite, opens instantly and reads only cells that are shown) or to one encrypted file (dat). Usage: migrate.')
+    # rotate
+    print('  \033[31mrotate\033[0m')
+    print('  Generate new passwords for cells chosen by search query (name, link or login), ID range and password age. Old passwords are kept in cell history. Usage: rotate.')
+    # audit
+    print('  \033[31maudit\033[0m')
+    print(f'  Find reused passwords, duplicate entries (same site and login) and weak passwords (below {audit.WEAK_BITS} bits), optionally export report. Usage: audit.')
     # delete_data
     print('  \033[31mdelete_data\033[0m')
     print('  Delete database and all password. Usage: delete_data.')
+    # import
+    print('  \033[31mimport\033[0m')
+    print('  Add cells from file: 1.0.0 .json, database.dat (key.dat must be in the same folder), or .csv/.xlsx made by export.')
+    print('  Cells with same name, login and link as existing ones are skipped. Usage: import.')
     # 1.0.0_import
     print('  \033[31m1.0.0_import\033[0m')
     print('  Allows to import .json database from 1.0.0 version of program. Usage: 1.0.0_import.')
+    # 1.0.2_import
+    print('  \033[31m1.0.2_import\033[0m')
+    print('  Allows to import database.dat from 1.0.1-1.0.2 (or later) version of program, key.dat (or vault.json since 1.2.0) must be in the same folder. Usage: 1.0.2_import.')
     # note
     print()
     print('Note: sometimes you can enter "x" to cancel.')
@@ -155,27 +285,35 @@ def initialize() -> None:
         new = input('Create password to enter an app: ')
         if new == '':
             print('Password field can\'t be empty.')
-    save_password(new)
+    params, key = kdf.create(new, kdf.calibrate(UNLOCK_TIME))
+    if not path.exists(path.dirname(DB_PATH)):
+        os.mkdir(path.dirname(DB_PATH))
+    kdf.save_params(VAULT_PATH, [params])
+    for i in [PF_PATH, KEY_PATH, DB_KEY_PATH]: # files of older versions
+        if path.exists(i):
+            os.remove(i)
     # do not create new file if there is already one (might be with password)
-    if not path.exists(DB_PATH):
-        _ = Database(db_path=DB_PATH, key_path=DB_KEY_PATH)
+    if not database_exists():
+        _ = Database(db_path=DB_PATH, key_path=DB_KEY_PATH, keys=[key])
         _.initialize()
 
 
+def database_exists() -> bool:
+    """Is there a database file (or SQLite database)."""
+    return path.exists(DB_PATH) or path.exists(SQLITE_PATH)
+
+
 def check_for_data() -> None:
     """Check if there are any passwords, if not - init()."""
-    if any([not path.exists(PF_PATH), not path.exists(KEY_PATH)]) and any([path.exists(DB_PATH), path.exists(DB_KEY_PATH)]):
+    has_password = path.exists(VAULT_PATH) or (path.exists(PF_PATH) and path.exists(KEY_PATH))
+    if not has_password and any([database_exists(), path.exists(DB_KEY_PATH)]):
         exit() # don't load password - a weak proof from password deletion thing
-    if path.exists(PF_PATH) and path.exists(KEY_PATH) and path.exists(DB_PATH):
-        p = load_password()
-        if not p:
-            initialize()
-    else:
+    if not has_password or not database_exists():
         initialize()
 
 
 def load_password() -> str:
-    """Load and encode password from data.dat."""
+    """Load password of 1.1.0 and older versions from data.dat."""
     with open(KEY_PATH, "rb") as file:
         key = file.readline()
     cipher = Fernet(key)
@@ -184,46 +322,82 @@ def load_password() -> str:
     return cipher.decrypt(encrypted_data).decode()
 
 
-def save_password(x: str) -> None:
-    """Encode and save password to data.dat."""
-    key = Fernet.generate_key()
-    cipher = Fernet(key)
-    encrypted_data = cipher.encrypt(x.encode())
-    with open(PF_PATH, "wb") as file:
-        file.write(encrypted_data)
-    with open(KEY_PATH, "wb") as file:
-        file.write(key)
-
-
-def log_in() -> None:
-    """Enter a password to open an app."""
-    password = load_password()
-    input_password = getpass('Enter password: ')
-    while input_password not in [password, 'x', 'X']:
+def unlock(password: str) -> list:
+    """Get database keys derived from password, empty list if password is wrong."""
+    if not path.exists(VAULT_PATH): # 1.1.0 and older: password is checked against data.dat, then replaced by vault.json
+        if password != load_password():
+            return []
+        params, _ = kdf.create(password, kdf.calibrate(UNLOCK_TIME))
+        kdf.save_params(VAULT_PATH, [params])
+    keys = kdf.unlock(password, kdf.load_params(VAULT_PATH))
+    if not keys:
+        return []
+    for i in [PF_PATH, KEY_PATH]:
+        if path.exists(i):
+            os.remove(i)
+    if path.exists(DB_KEY_PATH): # database is still encrypted with key from file, see open_database()
+        with open(DB_KEY_PATH, 'rb') as key_file:
+            keys += [i.strip() for i in key_file if i.strip()]
+    return keys
+
+
+def rekey(password: str, cost: dict=None) -> None:
+    """Derive database key from password with new salt (and KDF cost, if given), re-encrypt database with it."""
+    old = kdf.load_params(VAULT_PATH)
+    params, key = kdf.create(password, cost or old[0])
+    kdf.save_params(VAULT_PATH, [params] + old) # until database is rewritten, old password still opens it
+    database.reencrypt(key)
+    kdf.save_params(VAULT_PATH, [params])
+
+
+def log_in() -> list:
+    """Enter a password to open an app. Returns database keys."""
+    while True:
         input_password = getpass('Enter password: ')
-    if input_password in ['x', 'X']:
-        exit()
+        if input_password in ['x', 'X']:
+            exit()
+        keys = unlock(input_password)
+        if keys:
+            return keys
 
 
 def change_password() -> None:
     """Update password of the app."""
     print('Changing app password.')
-    password = load_password()
     p = input('Enter old password: ')
-    if p != password:
+    if not unlock(p):
         print('Wrong password. Cancelled.')
         return
     new = input('Enter new password: ')
     if not new:
         print('Password field can\'t be empty.')
+        return
     confirm = input('Confirm new password: ')
     if new != confirm:
         print('Passwords don\'t match.')
         return
-    save_password(new)
+    rekey(new)
     print('Password changed!')
 
 
+def calibrate_kdf() -> None:
+    """Choose KDF cost for target unlock time on this computer, re-encrypt database."""
+    print('Calibrating password key.')
+    target = input(f'Target unlock time in seconds (default {UNLOCK_TIME}): ')
+    try:
+        target = float(target) if target else UNLOCK_TIME
+    except ValueError:
+        print('Incorrect value. Cancelled.')
+        return
+    p = input('Enter password: ')
+    if not unlock(p):
+        print('Wrong password. Cancelled.')
+        return
+    cost = kdf.calibrate(target)
+    rekey(p, cost)
+    print(f'Key cost set to n={cost["n"]}, r={cost["r"]}, p={cost["p"]}.')
+
+
 def delete_data() -> None:
     """Delete database and key."""
     print('Warning! Do you really want to delete all data?')
@@ -233,10 +407,11 @@ def delete_data() -> None:
         print('Cancelled.')
         return
     
-    os.remove(PF_PATH)
-    os.remove(KEY_PATH)
-    os.remove(DB_PATH)
-    os.remove(DB_KEY_PATH)
+    autosaver.stop(save=False) # it must not write files again
+    database.close()
+    for i in [VAULT_PATH, DB_PATH, DB_PATH + '.journal', SQLITE_PATH, SNAPSHOT_PATH, PF_PATH, KEY_PATH, DB_KEY_PATH]:
+        if path.exists(i):
+            os.remove(i)
     os.rmdir(os.path.dirname(DB_PATH))
     print('Successfully deleted all data.')
     print('Hit "Enter" to exit.')
@@ -265,9 +440,10 @@ def search(cmd: str) -> None:
         i = 0.5
 
     print(f'Searching for "{query}" with {round(i*100, 1)}% accuracy.')
-    search_results = database.search_db(query, i)
+    search_results = database.rank(query, i)
     print(f'Found {len(search_results)} matches.')
-    for cell in search_results:
+    for score, cell in search_results:
+        print(f'Score: {round(score*100, 1)}%')
         print_cell(cell, True)
 
 
@@ -309,7 +485,7 @@ def edit_cell(cell_id: int) -> DataCell:
         if choice in cell_content:
             i = input('new '+choice+': ')
             cell.update(choice, i)
-            os.system('cls')
+            clear_screen()
             print_cell(cell, False)
             edit_cell(cell_content)
     return cell
@@ -317,35 +493,13 @@ def edit_cell(cell_id: int) -> DataCell:
 
 def input_id() -> tuple:
     """Enter existing ID."""
-    cell_id = ''
-    while cell_id not in database.ids():
-        cell_id = input('ID: ')
+    while True:
+        cell_id = input('ID: ').strip()
         if cell_id.lower() == 'x': # cancel
             return 0, True
-        if cell_id.isnumeric():
-            cell_id = int(cell_id)
-        if cell_id not in database.ids():
-            print('Incorrect ID!')
-    return cell_id, False
-
-
-def gen_password(length: int) -> str:
-    """Create a string of random letters (uppercase and lowercase), numbers and special characters."""
-    if length < 6: # length too min to create reliable password
-        characters = string.ascii_letters + string.digits + string.punctuation
-        password = ''.join(choice(characters) for _ in range(length))
-        return password
-    # 1/6 - punctuation, 2/6 - digits, 3/6 - letters
-    punctuation_amount = length // 6
-    dig_amount = length // 6 * 2
-    let_amount = length - punctuation_amount - dig_amount
-    to_build_from = [choice(string.punctuation) for _ in range(punctuation_amount)] + [choice(string.digits) for _ in range(dig_amount)] + [choice(string.ascii_lowercase) for _ in range(let_amount//2)] + [choice(string.ascii_uppercase) for _ in range(let_amount - let_amount//2)]
-    password = ''
-    for _ in range(length):
-        l = choice(to_build_from)
-        password += l
-        to_build_from.remove(l)
-    return password
+        if cell_id.isdecimal() and database.find_cell(int(cell_id)) is not None: # only numbers are looked up
+            return int(cell_id), False
+        print('Incorrect ID!')
 
 
 def parse_int(s: str, default_value: int) -> int:
@@ -371,29 +525,17 @@ def new_cell() -> DataCell:
         x[i] = input(to_show)
         if i == 'password' and x[i].startswith('\t'): # tab - generate password
             n = parse_int(x[i], 10)
-            password = gen_password(n)
+            password = passgen.generate(n)
             x[i] = password
             print(f'\033[1;30m{to_show}{password}\033[0m')
     x['id'] = database.gen_id()
+    x['changed'] = time.time() # password age, for rotation
     return DataCell(x)
 
 
 def print_cell(cell: DataCell, show_id: bool) -> None:
     """Print data cell content"""
-    print('----------')
-    if show_id:
-        print(f'\033[32mname\033[0m:       {cell.name}')
-    else:
-        print(f'name:       {cell.name}')
-    print(f'link:       {cell.link}')
-    print(f'login:      {cell.login}')
-    print(f'email:      {cell.email}')
-    print(f'password:   {cell.password}')
-    print(f'other data: {cell.other_data}')
-    print(f'codes:      {cell.codes}')
-    if show_id:
-        print(f'\033[35mid\033[0m:         {cell.id}')
-    print('----------')
+    sys.stdout.write(format_cell(cell, show_id))
 
 
 def print_db(command: str, psize: int = 2) -> None:
@@ -401,36 +543,30 @@ def print_db(command: str, psize: int = 2) -> None:
     if not database.data_cells:
         print('Database is empty.')
         return
-    page_amount = len(database.data_cells) // psize + bool(len(database.data_cells) % psize)
+    pages = Pager(database.data_cells, psize)
     page = 0 # start from 0
-    while 0 <= page <= page_amount:
-        print(f'{len(database.data_cells)} entries')
-        is_prev_page = False
-        if page == page_amount: # last page
-            cells = database.data_cells[page_amount*psize:] # these cells will be printed
+    clear = False # main loop has just cleared screen and printed command
+    while 0 <= page < pages.page_amount():
+        pages.show(page, f'> {command}\n' if clear else '', clear)
+        clear = True
+        n = input('...').strip()
+        if n.lower() == 'x': # cancel viewing DB
+            return
+        if n.lower() == 'b': # previous page
+            page -= 1
+        elif n.startswith('/'): # jump to first name starting with ...
+            start, end = database.prefix_range(n[1:])
+            if start != end:
+                page = start // pages.psize
+        elif n.isdecimal(): # jump to page number
+            page = min(max(int(n), 1), pages.page_amount()) - 1
         else:
-            cells = database.data_cells[page*psize:(page+1)*psize]
-        for cell in cells:
-            print_cell(cell, True)
-
-        if page != page_amount:
-            print(f'[{page + 1}/{page_amount}]')
-            n = input('...')
-            if n.lower() == 'x': # cancel viewing DB
-                return
-            is_prev_page = bool(n.lower() == 'b')
-            os.system('cls')
-            print(f'> {command}')
-        if not is_prev_page:
             page += 1
-        else: # previous page is selected
-            page -= 1
 
 
 def import_db(db_path: str, version: str) -> None:
-    """Import database from previous versions of psm."""
-    versions = ['1.0.0']
-    if version not in versions:
+    """Import database from previous versions of psm or exported table. Duplicates are skipped."""
+    if version not in IMPORT_FORMATS:
         print(f'Wrong version {version}')
         return
     if version == '1.0.0': # unencrypted .json database
@@ -440,11 +576,168 @@ def import_db(db_path: str, version: str) -> None:
         except json.decoder.JSONDecodeError:
             print('Unable to load file.')
             return
-        database.save()
-        db_json = database.get_json()
-        db_json.extend(data)
-        database.load(db_json)
-        print('Successfully imported DB v 1.0.0!')
+    elif version == '1.0.2': # encrypted database, single token or chunks
+        key_path = path.join(path.dirname(db_path), 'key.dat')
+        vault_path = path.join(path.dirname(db_path), 'vault.json')
+        if path.exists(key_path):
+            keys = None
+        elif path.exists(vault_path): # 1.2.0 and later: key is derived from password of that installation
+            keys = kdf.unlock(getpass('Enter password of imported database: '), kdf.load_params(vault_path))
+            if not keys:
+                print('Wrong password.')
+                return
+        else:
+            print('No key.dat or vault.json next to database file.')
+            return
+        data = Database(db_path=db_path, key_path=key_path, keys=keys).iter_json()
+    else: # table made by export
+        data = read_table(db_path)
+    try:
+        added, skipped = database.merge(data)
+    except (InvalidToken, ValueError, KeyError, OSError, BadZipFile):
+        print('Unable to load file.')
+        return
+    print(f'Successfully imported DB v {version}!' if version in ['1.0.0', '1.0.2'] else f'Successfully imported {version} file!')
+    print(f'Added {added} cells, skipped {skipped} duplicates.')
+
+
+def select_cells(query: str='', x: float=0.5, id_range: tuple=None, older_than: float=None) -> list:
+    """Cells matching all given conditions: search query (name, link or login), (first, last) ID range, password older than given days.
+    Cells with unknown password age (made by older versions) are treated as old."""
+    if query:
+        matcher = Matcher(query)
+        cells = [i for i in database.search_db(query, x) if any(matcher.similarity(getattr(i, field).lower(), x) >= x - EPSILON for field in ROTATE_FIELDS)]
+    else:
+        cells = list(database.data_cells)
+    if id_range is not None:
+        cells = [i for i in cells if id_range[0] <= i.id <= id_range[1]]
+    if older_than is not None:
+        limit = time.time() - older_than * 86400
+        cells = [i for i in cells if i.changed is None or i.changed < limit]
+    return cells
+
+
+def rotate_passwords(cells: list, length: int) -> list:
+    """Give new generated passwords to cells, all in one change. Returns changed cells as they are in database now
+    (cells of a lazy database are copies, set_passwords changes loaded ones)."""
+    passwords = passgen.generate_batch(len(cells), length)
+    database.set_passwords({cell.id: password for cell, password in zip(cells, passwords)})
+    return [database.find_cell(cell.id) for cell in cells]
+
+
+def rotate_command() -> None:
+    """Choose cells and rotate their passwords, optionally export report."""
+    print('Rotating passwords. Leave field empty to skip condition.')
+    query = input('Search query: ').strip()
+    try:
+        id_range = input('ID range (first last): ').split()
+        id_range = (int(id_range[0]), int(id_range[-1])) if id_range else None
+        older_than = input('Password older than (days): ').strip()
+        older_than = float(older_than) if older_than else None
+    except ValueError:
+        print('Incorrect value. Cancelled.')
+        return
+    cells = select_cells(query, 0.5, id_range, older_than)
+    if not cells:
+        print('No cells selected.')
+        return
+    length = parse_int(input('Password length (default 16): '), 16)
+    if input(f'Change passwords of {len(cells)} cells? (y/n): ').lower() != 'y':
+        print('Cancelled.')
+        return
+    cells = rotate_passwords(cells, length)
+    autosaver.flush() # one write for whole rotation
+    print(f'Changed {len(cells)} passwords!')
+    print('Export report with new passwords? Enter "x" to skip.')
+    export_format, is_cancelled = choose_from(database.export_formats, 'format')
+    if not is_cancelled:
+        savedir, is_cancelled = enter_dir()
+        if not is_cancelled:
+            database.export_db(savedir, export_format, cells, 'rotation')
+
+
+def print_audit(result: dict) -> None:
+    """Print summary of audit result, first AUDIT_SHOW groups of each issue."""
+    for title, groups in [('Reused passwords', result['reused']), ('Duplicate entries', result['duplicates'])]:
+        print(f'{title}: {len(groups)} groups, {sum(len(i) for i in groups)} cells.')
+        for group in groups[:AUDIT_SHOW]:
+            more = ', ...' if len(group) > 5 else ''
+            print(f'  {len(group)} cells: {", ".join(i.name for i in group[:5])}{more} (IDs: {", ".join(str(i.id) for i in group[:5])}{more})')
+    print(f'Weak passwords: {len(result["weak"])} cells.')
+    for cell in result['weak'][:AUDIT_SHOW]:
+        print(f'  {cell.name} (ID {cell.id}): {result["bits"][cell.id]:.0f} bits')
+
+
+def audit_command() -> None:
+    """Audit whole database, optionally export report."""
+    result = audit.audit(database.data_cells)
+    print_audit(result)
+    cells, columns = audit.report(result)
+    if not cells:
+        return
+    print('Export report? Enter "x" to skip.')
+    export_format, is_cancelled = choose_from(database.export_formats, 'format')
+    if not is_cancelled:
+        savedir, is_cancelled = enter_dir()
+        if not is_cancelled:
+            database.export_db(savedir, export_format, cells, 'audit', columns)
+
+
+def migrate(to: str) -> None:
+    """Move database to SQLite file or back to database.dat. New storage is written completely before old one is removed."""
+    if (to == 'sqlite') == (database.store is not None):
+        print(f'Database is already stored as {to}.')
+        return
+    if to == 'sqlite':
+        from sqlstore import SqliteStore
+        database.move_to(store=SqliteStore(SQLITE_PATH))
+        for i in [DB_PATH, DB_PATH + '.journal', SNAPSHOT_PATH]:
+            if path.exists(i):
+                os.remove(i)
+    else:
+        store = database.store
+        database.move_to(backend=FileBackend(DB_PATH))
+        store.close()
+        os.remove(SQLITE_PATH)
+    print(f'Database is stored as {to} now!')
+
+
+def stats_command(command: str) -> None:
+    """Turn metrics on/off, reset or print them."""
+    arg = command.split()[-1]
+    if arg in ['on', 'off']:
+        metrics.enabled = arg == 'on'
+        print(f'Metrics are {arg}.')
+    elif arg == 'reset':
+        metrics.reset()
+        print('Metrics are reset.')
+    elif not metrics.enabled and not metrics.timers:
+        print('Metrics are off. Type "stats on" or start psm.py with --profile.')
+    else:
+        for line in metrics.report():
+            print(line)
+
+
+def profile(fn, *args) -> None:
+    """Run fn with metrics, cProfile and tracemalloc on, print what was measured at the end."""
+    import cProfile
+    import pstats
+    import tracemalloc
+    metrics.enabled = True
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(fn, *args)
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        profiler.dump_stats(PROFILE_PATH)
+        print()
+        for line in metrics.report():
+            print(line)
+        print(f'Peak memory: {peak / 2**20:.1f} MiB.')
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+        print(f'Full profile is saved to {path.abspath(PROFILE_PATH)}.')
 
 
 def choose_from(x: list, text: str='value') -> tuple:
@@ -458,11 +751,179 @@ def choose_from(x: list, text: str='value') -> tuple:
     return val, False
 
 
+def read_cells(file_path: str) -> list:
+    """Read list of cell dictionaries from .json (list) or .ndjson (one per line) file."""
+    with open(file_path, encoding='utf-8') as f:
+        if file_path.lower().endswith('.json'):
+            return json.load(f)
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def print_cells(cells: list, as_json: bool) -> None:
+    """Print cells for batch mode, as JSON lines or like in app."""
+    for cell in cells:
+        if as_json:
+            print(json.dumps(cell.to_dict()))
+        else:
+            print_cell(cell, True)
+
+
+def cli(argv: list) -> None:
+    """Run one command without interactive loop. All changes are saved once, at the end."""
+    parser = argparse.ArgumentParser(prog='psm.py', description='Batch mode. Password is taken from PSM_PASSWORD environment variable or asked once. Add --profile to any command (or run psm.py --profile) to print timings, memory peak and cProfile results.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help='add cells from .json (list) or .ndjson file, ids are given by database')
+    add.add_argument('--from', dest='file', required=True)
+    edit = commands.add_parser('edit', help='change cells from .json (list) or .ndjson file, each item must have id')
+    edit.add_argument('--from', dest='file', required=True)
+    delete = commands.add_parser('delete', help='delete cells by id')
+    delete.add_argument('--id', type=int, nargs='+', required=True)
+    get = commands.add_parser('get', help='print cells by id or by exact name')
+    get_by = get.add_mutually_exclusive_group(required=True)
+    get_by.add_argument('--id', type=int, nargs='+')
+    get_by.add_argument('--name', help='case insensitive, with SQLite storage only matching cells are decrypted')
+    get.add_argument('--json', action='store_true', help='print JSON lines')
+    search = commands.add_parser('search', help='search in database')
+    search.add_argument('query', nargs='+')
+    search.add_argument('--accuracy', type=float, default=0.5, help='indicator of similarity, 0-1')
+    search.add_argument('--limit', type=int, default=None, help='show only this many best matches')
+    search.add_argument('--json', action='store_true', help='print JSON lines')
+    import_ = commands.add_parser('import', help='add cells from file, skipping duplicates (same name, login and link)')
+    import_.add_argument('format', choices=IMPORT_FORMATS, help='1.0.0 (.json), 1.0.2 (database.dat with key.dat next to it), csv or xlsx (made by export)')
+    import_.add_argument('file')
+    rotate = commands.add_parser('rotate', help='generate new passwords for cells matching all given conditions, old ones are kept in cell history')
+    rotate.add_argument('--query', default='', help='search query, matched against name, link and login')
+    rotate.add_argument('--accuracy', type=float, default=0.5, help='indicator of similarity for query, 0-1')
+    rotate.add_argument('--id-range', type=int, nargs=2, default=None, metavar=('FIRST', 'LAST'))
+    rotate.add_argument('--older-than', type=float, default=None, metavar='DAYS', help='password age, cells without known age count as old')
+    rotate.add_argument('--length', type=int, default=16)
+    rotate.add_argument('--dry-run', action='store_true', help='only list cells that would be changed')
+    rotate.add_argument('--report', nargs=2, default=None, metavar=('FORMAT', 'DIRECTORY'), help='export changed cells')
+    audit_ = commands.add_parser('audit', help='find reused passwords, duplicate entries (same site and login) and weak passwords')
+    audit_.add_argument('--weak-bits', type=float, default=audit.WEAK_BITS, help='passwords with lower estimated strength are weak')
+    audit_.add_argument('--report', nargs=2, default=None, metavar=('FORMAT', 'DIRECTORY'), help='export all found cells with issue, group and strength')
+    migrate_ = commands.add_parser('migrate', help='move database to SQLite file (sqlite) or to one encrypted file (dat)')
+    migrate_.add_argument('format', choices=STORAGE_FORMATS)
+    export = commands.add_parser('export', help='export database')
+    export.add_argument('format', choices=Database().export_formats)
+    export.add_argument('directory')
+    args = parser.parse_args(argv)
+    # file paths are given relative to where user is, not psm directory
+    if hasattr(args, 'file'):
+        args.file = path.abspath(args.file)
+    if hasattr(args, 'directory'):
+        args.directory = path.abspath(args.directory)
+    if getattr(args, 'report', None):
+        args.report[1] = path.abspath(args.report[1])
+
+    set_paths()
+    if not database_exists() or not (path.exists(VAULT_PATH) or path.exists(PF_PATH)):
+        print('No database found. Run psm.py without arguments to create it.')
+        sys.exit(1)
+    keys = unlock(os.environ.get('PSM_PASSWORD') or getpass('Enter password: '))
+    if not keys:
+        print('Wrong password.')
+        sys.exit(1)
+    global database
+    database = open_database(keys)
+
+    if args.command == 'add':
+        cells = read_cells(args.file)
+        for i in cells:
+            cell = DataCell(i)
+            if cell.changed is None and cell.password: # password age starts now, as with "new"
+                cell.changed = time.time()
+            cell.id = database.gen_id()
+            database.update(cell)
+        database.save()
+        print(f'Added {len(cells)} cells.')
+    elif args.command == 'edit':
+        changed = 0
+        for i in read_cells(args.file):
+            cell = database.find_cell(i.get('id'))
+            if cell is None:
+                print(f'No cell with ID {i.get("id")}, skipped.')
+                continue
+            for field in FIELDS:
+                if field in i:
+                    cell.update(field, i[field])
+            database.update(cell)
+            changed += 1
+        database.save()
+        print(f'Changed {changed} cells.')
+    elif args.command == 'delete':
+        deleted = 0
+        for i in args.id:
+            if database.find_cell(i) is None:
+                print(f'No cell with ID {i}, skipped.')
+                continue
+            database.rm(i)
+            deleted += 1
+        database.save()
+        print(f'Deleted {deleted} cells.')
+    elif args.command == 'get':
+        if args.name is not None:
+            print_cells(database.find_by('name', args.name), args.json)
+        else:
+            print_cells([database.find_cell(i) for i in args.id if database.find_cell(i) is not None], args.json)
+    elif args.command == 'search':
+        if not (0.0 <= args.accuracy <= 1.0):
+            print('Incorrect value of accuracy.')
+            sys.exit(1)
+        print_cells(database.search_db(' '.join(args.query), args.accuracy, args.limit), args.json)
+    elif args.command == 'import':
+        import_db(args.file, args.format)
+        database.save()
+    elif args.command == 'rotate':
+        if args.report and args.report[0] not in database.export_formats:
+            print(f'Report format must be one of: {", ".join(database.export_formats)}.')
+            sys.exit(1)
+        cells = select_cells(args.query, args.accuracy, args.id_range and tuple(args.id_range), args.older_than)
+        if args.dry_run:
+            for cell in cells:
+                print(f'{cell.id}: {cell.name}')
+            print(f'Would change {len(cells)} passwords.')
+        else:
+            cells = rotate_passwords(cells, args.length)
+            database.save()
+            print(f'Changed {len(cells)} passwords.')
+            if args.report and cells:
+                database.export_db(args.report[1], args.report[0], cells, 'rotation')
+    elif args.command == 'audit':
+        if args.report and args.report[0] not in database.export_formats:
+            print(f'Report format must be one of: {", ".join(database.export_formats)}.')
+            sys.exit(1)
+        result = audit.audit(database.data_cells, args.weak_bits)
+        print_audit(result)
+        cells, columns = audit.report(result)
+        if args.report and cells:
+            database.export_db(args.report[1], args.report[0], cells, 'audit', columns)
+    elif args.command == 'migrate':
+        migrate(args.format)
+    elif args.command == 'export':
+        database.export_db(args.directory, args.format)
+    database.write_snapshot()
+    database.close()
+
+
 # main() # DEBUG
 
 if __name__ == '__main__':
+    argv = sys.argv[1:]
+    profiling = '--profile' in argv
+    if profiling:
+        argv.remove('--profile')
+    if argv: # batch mode
+        if profiling:
+            profile(cli, argv)
+        else:
+            cli(argv)
+        sys.exit()
     try:
-        main()
+        if profiling:
+            profile(main)
+        else:
+            main()
     except Exception as e:
         print('A program error has occurred:')
         print(e)
@@ -0,0 +1,111 @@
+import heapq
+
+
+# fields that identify a resource rank above secrets and notes
+FIELD_WEIGHTS = {
+    'name': 1.0,
+    'link': 0.95,
+    'login': 0.9,
+    'email': 0.9,
+    'other_data': 0.8,
+    'codes': 0.7,
+    'password': 0.6
+}
+EPSILON = 1e-9 # float error allowed when similarity is compared with cutoff: 1 - 1/10 must pass x=0.9
+
+
+class Matcher:
+    """Scores strings against one query. Query is prepared once, then each string costs one pass."""
+    def __init__(self, query: str):
+        self.query = query.lower()
+        self._peq = {} # char -> bit mask of its positions in query
+        for i, c in enumerate(self.query):
+            self._peq[c] = self._peq.get(c, 0) | (1 << i)
+        self._counts = {c: self.query.count(c) for c in self._peq}
+        self._mask = (1 << len(self.query)) - 1
+        self._last = 1 << (len(self.query) - 1) if self.query else 0
+
+    def distance(self, text: str, limit: int=None) -> int:
+        """Levenshtein distance between query and text. Myers' bit-parallel algorithm: one pass over text.
+        If distance is surely above limit, stops early and returns limit + 1."""
+        if not self.query:
+            return len(text) if limit is None or len(text) <= limit else limit + 1
+        pv, mv, score = self._mask, 0, len(self.query)
+        if limit is None:
+            limit = score + len(text)
+        left = len(text) # score can drop by at most 1 per char left
+        for c in text:
+            eq = self._peq.get(c, 0)
+            xv = eq | mv
+            xh = (((eq & pv) + pv) ^ pv) | eq
+            ph = mv | (~(xh | pv) & self._mask)
+            mh = pv & xh
+            if ph & self._last:
+                score += 1
+            elif mh & self._last:
+                score -= 1
+            ph = ((ph << 1) | 1) & self._mask
+            mh = (mh << 1) & self._mask
+            pv = mh | (~(xv | ph) & self._mask)
+            mv = ph & xv
+            left -= 1
+            if score - left > limit:
+                return limit + 1
+        return score
+
+    def similarity(self, text: str, x: float=0.0) -> float:
+        """Similarity of query and text (lowercase) from 0 to 1. Returns 0 early if it can't reach x."""
+        q = self.query
+        if not q or not text:
+            return 0.0
+        if q == text:
+            return 1.0
+        # fast paths, no edit distance to whole text needed (it can't score higher); words of text may still match better
+        best = 0.0
+        parts = [text]
+        if text.startswith(q):
+            best, parts = 0.8 + 0.2 * len(q) / len(text), []
+        elif q in text:
+            best, parts = 0.6 + 0.2 * len(q) / len(text), []
+        if ' ' in text: # token set: "my site" matches "site"
+            parts += text.split()
+        for part in parts:
+            if part == q:
+                return 1.0
+            longest = max(len(q), len(part))
+            limit = int((1 - max(x, best)) * longest + EPSILON) # more edits than this can't beat x or best
+            if abs(len(q) - len(part)) > limit: # length difference alone is too big
+                continue
+            # every query char missing in text and every text char missing in query costs an edit
+            chars = set(part)
+            missing = sum(self._counts[c] for c in self._counts.keys() - chars)
+            extra = len(part) - sum(part.count(c) for c in self._counts.keys() & chars)
+            if max(missing, extra) > limit:
+                continue
+            best = max(best, 1 - self.distance(part, limit) / longest)
+        return best
+
+
+def rank(query: str, cells, x: float=0.5, k: int=None) -> list:
+    """Score cells by best weighted field similarity. Fields below x don't count. Returns k best (all if k is None) as (score, cell), best first."""
+    matcher = Matcher(query)
+    scored = []
+    for cell in cells:
+        best = 0.0
+        for field, weight in FIELD_WEIGHTS.items():
+            value = getattr(cell, field)
+            if not value:
+                continue
+            sim = matcher.similarity(value.lower(), x)
+            if sim >= x - EPSILON:
+                best = max(best, sim * weight)
+        if best > 0:
+            scored.append((best, cell))
+    order = lambda i: (i[0], -i[1].id) # ties: smaller id first
+    if k is not None:
+        return heapq.nlargest(k, scored, key=order) # O(n log k)
+    return sorted(scored, key=order, reverse=True)
+
+
+if __name__ == '__main__':
+    print("The ranking library file cannot be started.")
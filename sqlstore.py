@@ -0,0 +1,126 @@
+import json
+import sqlite3
+import threading
+import metrics
+from storage import RecordCipher
+
+
+HASHED_FIELDS = ['name', 'link', 'login'] # exact lookups by these go through an index
+TABLE = '''
+CREATE TABLE IF NOT EXISTS cells (
+    id INTEGER PRIMARY KEY,
+    pos REAL NOT NULL,
+    name_hash BLOB,
+    link_hash BLOB,
+    login_hash BLOB,
+    data BLOB
+)'''
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS cells_pos ON cells(pos)',
+    'CREATE INDEX IF NOT EXISTS cells_name_hash ON cells(name_hash)',
+    'CREATE INDEX IF NOT EXISTS cells_link_hash ON cells(link_hash)',
+    'CREATE INDEX IF NOT EXISTS cells_login_hash ON cells(login_hash)'
+]
+
+
+class SqliteStore:
+    """Cells as rows of a SQLite file, each row encrypted separately. Name, link and login also get keyed hashes,
+    so a row can be found without decrypting others. Rows are ordered by pos (same order as Database.data_cells)."""
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False) # saves may come from autosave thread
+        self._lock = threading.Lock()
+        self._cipher = None
+        self._count = None # row count cache, rows change only through this object
+
+    def set_keys(self, keys: list) -> None:
+        """Database keys, newest first. Newest one encrypts rows and keys hashes."""
+        self._cipher = RecordCipher(keys)
+
+    def create(self) -> None:
+        """Create table and indexes if they don't exist."""
+        with self._lock, self._conn:
+            self._conn.execute(TABLE)
+            for i in INDEXES:
+                self._conn.execute(i)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _row(self, pos: float, cell: dict) -> tuple:
+        """Encrypted row of cell dictionary."""
+        data = json.dumps({k: v for k, v in cell.items() if k != 'id'}).encode()
+        metrics.count('bytes_encrypted', len(data))
+        return (cell['id'], pos, *(self._cipher.hash(cell.get(i, '')) for i in HASHED_FIELDS), self._cipher.encrypt(cell['id'], data))
+
+    def _cell(self, id: int, data: bytes) -> dict:
+        """Cell dictionary of encrypted row."""
+        with metrics.timer('load.decrypt'):
+            cell = json.loads(self._cipher.decrypt(id, data))
+        cell['id'] = id
+        metrics.count('cells_decrypted')
+        return cell
+
+    def _query(self, sql: str, args: tuple=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def count(self) -> int:
+        if self._count is None:
+            self._count = self._query('SELECT COUNT(*) FROM cells')[0][0]
+        return self._count
+
+    def cells(self, start: int, stop: int) -> list:
+        """Cell dictionaries at positions start..stop-1 in name order."""
+        rows = self._query('SELECT id, data FROM cells ORDER BY pos LIMIT ? OFFSET ?', (max(0, stop - start), start))
+        return [self._cell(*i) for i in rows]
+
+    def sort_key_at(self, i: int) -> tuple:
+        """(lowercase name, id) of cell at position i."""
+        cell = self.cells(i, i + 1)[0]
+        return cell['name'].lower(), cell['id']
+
+    def find(self, id: int) -> dict:
+        """Cell dictionary by id, None if there is none."""
+        rows = self._query('SELECT id, data FROM cells WHERE id = ?', (id,))
+        return self._cell(*rows[0]) if rows else None
+
+    def find_by(self, field: str, value: str) -> list:
+        """Cells whose field equals value (case insensitive), found by keyed hash index."""
+        if field not in HASHED_FIELDS:
+            raise ValueError(f'Only {", ".join(HASHED_FIELDS)} are indexed.')
+        rows = self._query(f'SELECT id, data FROM cells WHERE {field}_hash = ? ORDER BY pos', (self._cipher.hash(value),))
+        return [self._cell(*i) for i in rows]
+
+    def ids(self) -> list:
+        return [i for i, in self._query('SELECT id FROM cells ORDER BY id')]
+
+    def iter_rows(self):
+        """(pos, cell dictionary) of all rows in name order."""
+        for id, pos, data in self._query('SELECT id, pos, data FROM cells ORDER BY pos'):
+            yield pos, self._cell(id, data)
+
+    def write_all(self, cells: list) -> None:
+        """Replace all rows with cells (dictionaries in name order), position = index. One transaction."""
+        rows = [self._row(float(i), cell) for i, cell in enumerate(cells)]
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM cells')
+            for i in INDEXES: # building indexes once is faster than updating them per row
+                self._conn.execute('DROP INDEX IF EXISTS ' + i.split()[5])
+            self._conn.executemany('INSERT INTO cells VALUES (?, ?, ?, ?, ?, ?)', rows)
+            for i in INDEXES:
+                self._conn.execute(i)
+        self._count = len(rows)
+
+    def apply(self, puts: list, removes: list) -> None:
+        """Put (pos, cell dictionary) rows and delete rows by id. One transaction."""
+        rows = [self._row(pos, cell) for pos, cell in puts]
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM cells WHERE id = ?', [(i,) for i in removes])
+            self._conn.executemany('INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self._count = None
+
+
+if __name__ == '__main__':
+    print("The sqlstore library file cannot be started.")
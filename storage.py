@@ -0,0 +1,214 @@
+from abc import ABC, abstractmethod
+import hashlib
+import os
+from os import path
+import threading
+from cryptography.fernet import InvalidToken
+import metrics
+# asyncio and AES-GCM are imported where used: they take long to import and are not needed before password prompt
+
+
+class Backend(ABC):
+    """Where database contents live. Database reads and writes them only through a backend, as lines of bytes.
+    Names are 'snapshot' (all cells) and 'journal' (changes since snapshot). Subclasses must implement all abstract methods."""
+    def create(self) -> None:
+        """Prepare an empty store."""
+
+    @abstractmethod
+    def exists(self, name: str) -> bool:
+        """Is there an item with this name."""
+
+    @abstractmethod
+    def lines(self, name: str):
+        """Iterate over lines (with b'\\n') of stored item. Raises FileNotFoundError if there is none."""
+
+    @abstractmethod
+    def write(self, name: str, lines) -> None:
+        """Replace item with lines. Old contents stay readable if this fails half way."""
+
+    @abstractmethod
+    def append(self, name: str, lines: list) -> None:
+        """Add lines to the end of item (created if missing), durable when this returns."""
+
+    @abstractmethod
+    def remove(self, name: str) -> None:
+        """Delete item if it exists."""
+
+    def read(self, name: str) -> bytes:
+        """Whole item at once."""
+        return b''.join(self.lines(name))
+
+    def state(self) -> list:
+        """Something that changes whenever stored items change, None if backend can't tell."""
+        return None
+
+    async def read_async(self, name: str) -> bytes:
+        """Read item in a worker thread, event loop is not blocked."""
+        import asyncio
+        return await asyncio.to_thread(self.read, name)
+
+    async def prefetch(self, names: list) -> None:
+        """Read items concurrently and keep them in memory, next lines() of each is served from there."""
+
+    def drop_prefetched(self) -> None:
+        """Forget read-ahead data that was not used."""
+
+
+class FileBackend(Backend):
+    """Database files on disk: snapshot is db_path, journal is next to it."""
+    def __init__(self, db_path: str):
+        self.paths = {'snapshot': db_path, 'journal': db_path + '.journal'}
+        self._prefetched = {} # name -> bytes read ahead, used once
+        self._lock = threading.Lock() # prefetch runs in its own thread
+
+    def create(self) -> None:
+        directory = path.dirname(self.paths['snapshot'])
+        if directory and not path.exists(directory):
+            os.mkdir(directory)
+
+    def exists(self, name: str) -> bool:
+        with self._lock:
+            if name in self._prefetched:
+                return True
+        return path.exists(self.paths[name])
+
+    def state(self) -> list:
+        """Size and modification time of each file (None if it doesn't exist)."""
+        result = []
+        for name in ['snapshot', 'journal']:
+            if path.exists(self.paths[name]):
+                stat = os.stat(self.paths[name])
+                result.append([stat.st_size, stat.st_mtime_ns])
+            else:
+                result.append(None)
+        return result
+
+    def lines(self, name: str):
+        with self._lock:
+            data = self._prefetched.pop(name, None)
+        if data is not None:
+            return iter(data.splitlines(keepends=True))
+        return self._file_lines(self.paths[name])
+
+    def _file_lines(self, file_path: str):
+        """Lines of file, it is closed when they end."""
+        with open(file_path, 'rb') as f:
+            yield from f
+
+    def read(self, name: str) -> bytes:
+        with open(self.paths[name], 'rb') as f:
+            return f.read()
+
+    def write(self, name: str, lines) -> None:
+        self._forget(name)
+        file_path = self.paths[name]
+        temp_path = file_path + '.tmp' # a crash while writing must not break old file
+        with open(temp_path, 'wb') as f:
+            for line in lines:
+                f.write(line)
+            with metrics.timer('save.fsync'):
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+
+    def append(self, name: str, lines: list) -> None:
+        self._forget(name)
+        with metrics.timer('save.fsync'), open(self.paths[name], 'ab') as f:
+            f.write(b''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self, name: str) -> None:
+        self._forget(name)
+        if path.exists(self.paths[name]):
+            os.remove(self.paths[name])
+
+    def _forget(self, name: str) -> None:
+        """Drop read-ahead data of item that is being changed."""
+        with self._lock:
+            self._prefetched.pop(name, None)
+
+    def drop_prefetched(self) -> None:
+        with self._lock:
+            self._prefetched.clear()
+
+    async def prefetch(self, names: list) -> None:
+        import asyncio
+        names = [i for i in names if path.exists(self.paths[i])]
+        with metrics.timer('load.prefetch'):
+            results = await asyncio.gather(*(self.read_async(i) for i in names), return_exceptions=True)
+        with self._lock:
+            for name, data in zip(names, results):
+                if isinstance(data, bytes): # on error file is read again later and error is shown then
+                    self._prefetched[name] = data
+
+
+class MemoryBackend(Backend):
+    """Keeps everything in memory. Stand-in store for tests and benchmarks, nothing touches disk."""
+    def __init__(self):
+        self.items = {} # name -> bytes
+
+    def exists(self, name: str) -> bool:
+        return name in self.items
+
+    def lines(self, name: str):
+        if name not in self.items:
+            raise FileNotFoundError(name)
+        return iter(self.items[name].splitlines(keepends=True))
+
+    def write(self, name: str, lines) -> None:
+        self.items[name] = b''.join(lines)
+
+    def append(self, name: str, lines: list) -> None:
+        self.items[name] = self.items.get(name, b'') + b''.join(lines)
+
+    def remove(self, name: str) -> None:
+        self.items.pop(name, None)
+
+
+class RecordCipher:
+    """Encrypts records one by one with AES-GCM (random nonce, record id as associated data), about 10x faster than Fernet per small record.
+    Keys are derived from database (Fernet) keys, newest first; records written with older keys can still be read."""
+    def __init__(self, keys: list):
+        from cryptography.exceptions import InvalidTag
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        self._invalid_tag = InvalidTag
+        self._aes = {} # key tag -> cipher
+        for key in keys:
+            record_key = hashlib.sha256(b'psm records ' + key).digest()
+            self._aes.setdefault(hashlib.sha256(record_key).digest()[:4], AESGCM(record_key))
+        self._tag = next(iter(self._aes))
+        self._hash_key = hashlib.sha256(b'psm index ' + keys[0]).digest()
+
+    def encrypt(self, id: int, data: bytes) -> bytes:
+        """Record: key tag, nonce, ciphertext with tag."""
+        nonce = os.urandom(12)
+        return self._tag + nonce + self._aes[self._tag].encrypt(nonce, data, str(id).encode())
+
+    def decrypt(self, id: int, record: bytes) -> bytes:
+        """Data of record, InvalidToken if it was changed, belongs to other id or key is unknown."""
+        aes = self._aes.get(bytes(record[:4]))
+        if aes is None:
+            raise InvalidToken
+        try:
+            return aes.decrypt(bytes(record[4:16]), bytes(record[16:]), str(id).encode())
+        except self._invalid_tag:
+            raise InvalidToken
+
+    def hash(self, value: str) -> bytes:
+        """Keyed hash of value for lookups, case and surrounding spaces are ignored."""
+        return hashlib.blake2b(value.strip().lower().encode(), key=self._hash_key, digest_size=16).digest()
+
+
+def prefetch_in_background(backend: Backend, names: list=['snapshot', 'journal']) -> threading.Thread:
+    """Start reading items in a background thread with its own event loop. Join it before loading database."""
+    def run() -> None:
+        import asyncio
+        asyncio.run(backend.prefetch(names))
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    print("The storage library file cannot be started.")